@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import logging
+import platform
+import subprocess
+
+from workload_gen import parse_count
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Constants
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(TOOLS_DIR, "benchmark")
+REGION_DIR = os.path.join(TOOLS_DIR, "region_statistics")
+SCRIPTS_DIR = os.path.join(TOOLS_DIR, "slc_mitigation", "scripts")
+# Above the kernel pid_max limit, so mitigate-user.py never touches the buffer of a live process
+FAKE_PID = 4999999
+
+
+# Build the list of stages to time, in run order
+def build_stages(name, samples, pid, extra_gen_args):
+    """
+    Returns:
+        list: (stage name, argv) tuples. Every stage runs inside the work folder.
+    """
+    python = sys.executable
+    return [
+        ("generate", [python, os.path.join(BENCH_DIR, "workload_gen.py"), "-o", ".", "-n", name,
+                      "-s", str(samples), "-p", str(pid)] + extra_gen_args),
+        ("hot_layout", [python, os.path.join(REGION_DIR, "hot_layout.py"), f"spe-{name}-br.csv",
+                        "-m", f"perf-{pid}.map"]),
+        ("region_map", [python, os.path.join(REGION_DIR, "region_map.py"), f"perf-{pid}.map", f"perf-{pid}.svg"]),
+        ("mitigate-user", [python, os.path.join(SCRIPTS_DIR, "mitigate-user.py"), "-d", "-p", str(pid)]),
+        # spe-region.py leaves the reused spe-parser CSVs in place
+        ("spe-region", [python, os.path.join(REGION_DIR, "spe-region.py"), name, "--skip-parser"]),
+    ]
+
+
+# Run one stage and collect its timing and memory usage
+def run_stage(stage, argv, workdir, log_file):
+    """
+    Returns:
+        dict: wall/cpu seconds, peak RSS in KB and exit status of the stage.
+    """
+    start = time.perf_counter()
+    with open(log_file, "ab") as log:
+        log.write(f"===== {stage}: {' '.join(argv)}\n".encode())
+        log.flush()
+        proc = subprocess.Popen(argv, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the rusage of this child only, unlike RUSAGE_CHILDREN
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+
+    return {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(rusage.ru_utime + rusage.ru_stime, 4),
+        "max_rss_kb": rusage.ru_maxrss,
+        "returncode": proc.returncode,
+    }
+
+
+# Compare the results with a baseline
+def compare(results, baseline, tolerance):
+    """
+    Log the change of every stage against the baseline.
+
+    Returns:
+        list: Names of the stages slower or bigger than the baseline by more than tolerance.
+    """
+    regressions = []
+    for stage, result in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None or result["returncode"] != 0 or base["returncode"] != 0:
+            logging.info(f"{stage:>14}: no comparable baseline")
+            continue
+        changes = []
+        for key in ("wall_s", "cpu_s", "max_rss_kb"):
+            ratio = result[key] / base[key] if base[key] else 1.0
+            changes.append(f"{key} {base[key]} -> {result[key]} ({ratio - 1:+.1%})")
+            if ratio > 1 + tolerance:
+                regressions.append(stage)
+        logging.info(f"{stage:>14}: " + ", ".join(changes))
+    return sorted(set(regressions))
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SPE/perf analysis tools on a synthetic workload.")
+    parser.add_argument("-s", "--samples", type=parse_count, default="1M", help="Number of samples, accepts k/M/G suffixes (default: 1M)")
+    parser.add_argument("-w", "--workdir", default="bench-work", help="Work folder, removed and recreated (default: bench-work)")
+    parser.add_argument("-r", "--report", default="bench-report.json", help="JSON report file (default: bench-report.json)")
+    parser.add_argument("-b", "--baseline", help="Baseline JSON report to compare with")
+    parser.add_argument("--save-baseline", help="Also save the results as a baseline to this file")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1, help="Allowed slowdown vs the baseline (default: 0.1)")
+    parser.add_argument("--stages", nargs="+", help="Only run these stages (generate always runs)")
+    parser.add_argument("--gen-args", default="", help="Extra arguments passed to workload_gen.py, e.g. \"--skew 1.3\"")
+    parser.add_argument("-p", "--pid", type=int, default=FAKE_PID, help=f"Fake pid used for the workload (default: {FAKE_PID})")
+    parser.add_argument("-k", "--keep", action="store_true", help="Keep the work folder")
+    args = parser.parse_args()
+
+    name = "synthetic.data"
+    workdir = os.path.abspath(args.workdir)
+    log_file = os.path.abspath(args.workdir + ".log")
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+    if os.path.exists(log_file):
+        os.remove(log_file)
+
+    results = {
+        "samples": args.samples,
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "stages": {},
+    }
+
+    for stage, argv in build_stages(name, args.samples, args.pid, args.gen_args.split()):
+        if args.stages and stage != "generate" and stage not in args.stages:
+            continue
+        logging.info(f"Running stage {stage}")
+        result = run_stage(stage, argv, workdir, log_file)
+        results["stages"][stage] = result
+        if result["returncode"] != 0:
+            logging.error(f"Stage {stage} failed with {result['returncode']}, see {log_file}")
+            if stage == "generate":
+                sys.exit(1)
+        else:
+            logging.info(f"Stage {stage}: {result['wall_s']}s wall, {result['cpu_s']}s cpu, {result['max_rss_kb']} KB peak RSS")
+
+        # Keep the per-stage run report of spe-region.py for a closer look
+        report_file = os.path.join(workdir, f"{name}-output", f"spe-region-report.{name}.json")
+        if stage == "spe-region" and os.path.exists(report_file):
+            with open(report_file, "r") as infile:
+                results["spe_region_report"] = json.load(infile)
+
+    # mitigate-user.py writes the shared buffer of the fake pid to /tmp
+    if os.path.exists(f"/tmp/addr_buffer.{args.pid}"):
+        os.remove(f"/tmp/addr_buffer.{args.pid}")
+    if not args.keep:
+        shutil.rmtree(workdir)
+
+    with open(args.report, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+    logging.info(f"Report saved to {args.report}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.report, args.save_baseline)
+        logging.info(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as infile:
+            baseline = json.load(infile)
+        if baseline.get("samples") != args.samples:
+            logging.warning(f"Baseline was taken with {baseline.get('samples')} samples, this run used {args.samples}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            logging.error(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        logging.info("No regression against the baseline")
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+import os
+import argparse
+import logging
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Constants
+USER_CODE_BASE = 0xffff6e000000       # JIT code cache
+KERNEL_CODE_BASE = 0xffff800010000000 # kernel text
+HEAP_BASE = 0xffff40000000
+HEAP_SIZE = 1024 * 1024 * 1024
+CHUNK_SIZE = 1000000
+
+# spe-parser CSV columns, pc is always the 3rd column and el the 4th
+LDST_HEADER = "cpu,op,pc,el,atomic,excl,ar,subclass,event,issue_lat,xlat_lat,total_lat,vaddr,paddr,ts,context"
+BR_HEADER = "cpu,op,pc,el,condition,indirect,event,issue_lat,total_lat,br_tgt,pred_tgt,ts,context"
+OTHER_HEADER = "cpu,op,pc,el,condition,event,issue_lat,total_lat,ts,context"
+
+# Share of samples per record kind
+LDST_RATIO = 0.4
+BR_RATIO = 0.2
+
+LDST_EVENTS = [
+    "RETIRED:L1D-ACCESS:TLB-ACCESS",
+    "RETIRED:L1D-ACCESS:L1D-REFILL:TLB-ACCESS:LLC-ACCESS",
+    "RETIRED:L1D-ACCESS:L1D-REFILL:TLB-ACCESS:LLC-ACCESS:LLC-REFILL",
+    "RETIRED:L1D-ACCESS:L1D-REFILL:TLB-ACCESS:LLC-ACCESS:LLC-REFILL:REMOTE-ACCESS",
+]
+LDST_EVENT_WEIGHTS = [0.85, 0.1, 0.04, 0.01]
+LDST_EVENT_LATENCY = [4, 30, 150, 400]
+
+
+class CodeSpace:
+    """Functions laid out back to back with a skewed (Zipf) hotness."""
+
+    def __init__(self, rng, count, base, mean_size, skew, prefix):
+        sizes = np.maximum(rng.lognormal(np.log(mean_size), 1.0, count).astype(np.uint64) // 4 * 4, 16)
+        gaps = rng.integers(0, 4, count).astype(np.uint64) * 64
+        self.sizes = sizes.astype(np.uint64)
+        self.starts = np.uint64(base) + np.concatenate([[0], np.cumsum(sizes + gaps)[:-1]]).astype(np.uint64)
+        self.names = [f"{prefix}{i}" for i in range(count)]
+
+        # Hot functions are scattered over the code space, not packed at the start
+        weights = 1.0 / np.arange(1, count + 1) ** skew
+        rng.shuffle(weights)
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def sample(self, rng, size):
+        """Pick `size` functions by hotness and a pc inside each of them."""
+        func = np.minimum(np.searchsorted(self.cdf, rng.random(size)), len(self.cdf) - 1)
+        offsets = (rng.random(size) * (self.sizes[func] // 4)).astype(np.uint64) * 4
+        return func, self.starts[func] + offsets
+
+
+# Format one chunk of spe-parser rows
+def format_spe_rows(rng, kind, cpu, pc, el, ts, user, kernel, is_kernel):
+    size = len(pc)
+    cpu = cpu.tolist()
+    pc = pc.tolist()
+    ts = ts.tolist()
+    el = el.tolist()
+
+    if kind == "ldst":
+        event_idx = rng.choice(len(LDST_EVENTS), size=size, p=LDST_EVENT_WEIGHTS)
+        lat = (np.take(LDST_EVENT_LATENCY, event_idx) * rng.uniform(0.8, 1.5, size)).astype(np.int64)
+        # Data accesses are skewed towards the start of the heap
+        vaddr = (HEAP_BASE + (rng.power(0.3, size) * HEAP_SIZE).astype(np.int64) // 8 * 8).tolist()
+        op = rng.choice(["LD", "ST"], size=size, p=[0.7, 0.3]).tolist()
+        events = [LDST_EVENTS[i] for i in event_idx.tolist()]
+        lat = lat.tolist()
+        return [f"{c},{o},0x{p:x},{e},0,0,0,GP-REG,{ev},{l // 4},1,{l},0x{v:x},0x{v & 0xfffffffff:x},{t},0\n"
+                for c, o, p, e, ev, l, v, t in zip(cpu, op, pc, el, events, lat, vaddr, ts)]
+
+    if kind == "br":
+        # Most branches stay inside the function, the rest go to another hot function
+        local = rng.random(size) < 0.7
+        taken = rng.random(size) < 0.75
+        _, user_tgt = user.sample(rng, size)
+        _, kernel_tgt = kernel.sample(rng, size)
+        remote_tgt = np.where(is_kernel, kernel_tgt, user_tgt)
+        local_tgt = np.array(pc, dtype=np.uint64) + (rng.integers(-64, 64, size) * 4).astype(np.uint64)
+        tgt = np.where(local, local_tgt, remote_tgt).tolist()
+        events = ["RETIRED" if t else "RETIRED:NOT-TAKEN" for t in taken.tolist()]
+        return [f"{c},B,0x{p:x},{e},COND,DIRECT,{ev},1,2,0x{g:x},0x0,{t},0\n"
+                for c, p, e, ev, g, t in zip(cpu, pc, el, events, tgt, ts)]
+
+    return [f"{c},OTHER,0x{p:x},{e},COND,RETIRED,1,2,{t},0\n"
+            for c, p, e, t in zip(cpu, pc, el, ts)]
+
+
+# Format one chunk of perf script lines
+def format_script_rows(cpu, pc, func, ts, is_kernel, user, kernel, pid, comm):
+    lines = []
+    for c, p, f, t, k in zip(cpu.tolist(), pc.tolist(), func.tolist(), ts.tolist(), is_kernel.tolist()):
+        space = kernel if k else user
+        dso = "[kernel.kallsyms]" if k else f"/tmp/perf-{pid}.map"
+        sym = space.names[f]
+        off = p - int(space.starts[f])
+        lines.append(f"{comm:>16} {pid:>7} [{c:03d}] {t / 1e9:.9f}:      50000 cycles:P: {p:>16x} {sym}+0x{off:x} ({dso})\n")
+    return lines
+
+
+# Generate all workload files
+def generate(output_dir, name, samples, functions, kernel_functions, skew, kernel_ratio, cpus, pid, seed):
+    """
+    Generate spe-parser CSVs, perf script text, a JIT perf map, kallsyms and
+    modules files and the profiling handoff files (ins-uniq.<pid>.csv,
+    ins-uniq-kernel.csv).
+
+    Args:
+        output_dir (str): Folder to write the files to.
+        name (str): Name of the fake perf.data, used the same way as spe-region.py.
+        samples (int): Number of samples to generate.
+        functions (int): Number of JIT functions.
+        kernel_functions (int): Number of kernel functions.
+        skew (float): Zipf exponent of the function hotness.
+        kernel_ratio (float): Share of kernel samples.
+        cpus (int): Number of CPUs the samples are spread on.
+        pid (int): Fake pid of the profiled process.
+        seed (int): Random seed, the same seed generates the same files.
+    """
+    rng = np.random.default_rng(seed)
+    user = CodeSpace(rng, functions, USER_CODE_BASE, 1024, skew, "Ljava/lang/Synthetic;::method")
+    kernel = CodeSpace(rng, kernel_functions, KERNEL_CODE_BASE, 512, skew, "ksym_")
+    os.makedirs(output_dir, exist_ok=True)
+
+    with open(os.path.join(output_dir, f"perf-{pid}.map"), "w") as outfile:
+        for start, size, sym in zip(user.starts.tolist(), user.sizes.tolist(), user.names):
+            outfile.write(f"{start:x} {size:x} {sym}\n")
+
+    # Kernel symbols, the last functions belong to modules
+    module_count = 5
+    module_first = np.linspace(int(kernel_functions * 0.8), kernel_functions, module_count + 1).astype(int)
+    with open(os.path.join(output_dir, "kallsyms"), "w") as outfile:
+        for i, (start, sym) in enumerate(zip(kernel.starts.tolist(), kernel.names)):
+            module = np.searchsorted(module_first, i, side="right") - 1
+            suffix = f"\t[synth_mod{module}]" if module >= 0 else ""
+            outfile.write(f"{start:016x} t {sym}{suffix}\n")
+    with open(os.path.join(output_dir, "modules"), "w") as outfile:
+        for module in range(module_count):
+            first, last = module_first[module], module_first[module + 1] - 1
+            start = int(kernel.starts[first])
+            size = int(kernel.starts[last] + kernel.sizes[last]) - start
+            outfile.write(f"synth_mod{module} {size} 0 - Live 0x{start:016x}\n")
+
+    spe_files = {}
+    for kind, header in (("ldst", LDST_HEADER), ("br", BR_HEADER), ("other", OTHER_HEADER)):
+        spe_files[kind] = open(os.path.join(output_dir, f"spe-{name}-{kind}.csv"), "w")
+        spe_files[kind].write(header + "\n")
+    script_file = open(os.path.join(output_dir, f"perf.{pid}.script"), "w")
+
+    user_lines = np.empty(0, dtype=np.uint64)
+    kernel_lines = np.empty(0, dtype=np.uint64)
+    ts_base = 1000000000000
+    done = 0
+
+    try:
+        while done < samples:
+            size = min(CHUNK_SIZE, samples - done)
+            is_kernel = rng.random(size) < kernel_ratio
+            user_func, user_pc = user.sample(rng, size)
+            kernel_func, kernel_pc = kernel.sample(rng, size)
+            func = np.where(is_kernel, kernel_func, user_func)
+            pc = np.where(is_kernel, kernel_pc, user_pc)
+            el = np.where(is_kernel, 2, 0)
+            cpu = rng.integers(0, cpus, size)
+            ts = ts_base + np.cumsum(rng.integers(100, 2000, size))
+            ts_base = int(ts[-1])
+
+            kind = rng.random(size)
+            masks = {
+                "ldst": kind < LDST_RATIO,
+                "br": (kind >= LDST_RATIO) & (kind < LDST_RATIO + BR_RATIO),
+                "other": kind >= LDST_RATIO + BR_RATIO,
+            }
+            for k, mask in masks.items():
+                spe_files[k].writelines(format_spe_rows(rng, k, cpu[mask], pc[mask], el[mask], ts[mask], user, kernel, is_kernel[mask]))
+            script_file.writelines(format_script_rows(cpu, pc, func, ts, is_kernel, user, kernel, pid, "java"))
+
+            cachelines = (pc >> np.uint64(6)) << np.uint64(6)
+            user_lines = np.union1d(user_lines, cachelines[~is_kernel])
+            kernel_lines = np.union1d(kernel_lines, cachelines[is_kernel])
+
+            done += size
+            logging.info(f"Generated {done}/{samples} samples")
+    finally:
+        for f in spe_files.values():
+            f.close()
+        script_file.close()
+
+    with open(os.path.join(output_dir, f"ins-uniq.{pid}.csv"), "w") as outfile:
+        outfile.writelines(f"{addr:x}\n" for addr in user_lines.tolist())
+    with open(os.path.join(output_dir, "ins-uniq-kernel.csv"), "w") as outfile:
+        outfile.writelines(f"{addr:x}\n" for addr in kernel_lines.tolist())
+
+    logging.info(f"Workload saved to {output_dir}")
+
+
+# Parse sizes like 1M or 1G
+def parse_count(value):
+    units = {"k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9, "b": 10 ** 9}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic SPE/perf workload for the analysis tools.")
+    parser.add_argument("-o", "--output-dir", default="workload", help="Folder to write the workload to (default: workload)")
+    parser.add_argument("-n", "--name", default="synthetic.data", help="Name of the fake perf.data file (default: synthetic.data)")
+    parser.add_argument("-s", "--samples", type=parse_count, default="1M", help="Number of samples, accepts k/M/G suffixes (default: 1M)")
+    parser.add_argument("-f", "--functions", type=int, default=20000, help="Number of JIT functions (default: 20000)")
+    parser.add_argument("--kernel-functions", type=int, default=5000, help="Number of kernel functions (default: 5000)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the code hotness (default: 1.1)")
+    parser.add_argument("--kernel-ratio", type=float, default=0.1, help="Share of kernel samples (default: 0.1)")
+    parser.add_argument("--cpus", type=int, default=64, help="Number of CPUs (default: 64)")
+    parser.add_argument("-p", "--pid", type=int, default=4242, help="Fake pid of the profiled process (default: 4242)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    generate(args.output_dir, args.name, args.samples, args.functions, args.kernel_functions,
+             args.skew, args.kernel_ratio, args.cpus, args.pid, args.seed)
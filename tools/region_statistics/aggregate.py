@@ -0,0 +1,71 @@
+import numpy as np
+
+# Pending unique keys merged once they reach this many rows (or 4x the kept ones)
+MERGE_ROWS = 1 << 20
+
+
+class GroupSums:
+    """
+    Sample count and value sums per key tuple, aggregated chunk by chunk
+    with np.unique and np.bincount so only the unique keys are kept in memory.
+
+    Args:
+        num_keys (int): Number of key columns.
+        num_values (int): Number of value columns summed per key.
+    """
+
+    def __init__(self, num_keys=1, num_values=0):
+        self.num_keys = num_keys
+        self.num_values = num_values
+        self.keys = np.empty((0, num_keys), dtype=np.int64)
+        self.sums = np.empty((0, num_values + 1), dtype=np.int64)
+        self.pending = []
+        self.pending_rows = 0
+
+    def add(self, keys, values=()):
+        """
+        Args:
+            keys (list): int64-compatible key arrays of the same length.
+            values (list): num_values arrays summed per key, bools count as 0/1.
+        """
+        keys = np.stack([np.asarray(k, dtype=np.int64) for k in keys], axis=1)
+        columns = [np.ones(len(keys), dtype=np.int64)] + [np.asarray(v, dtype=np.int64) for v in values]
+        self.pending.append(regroup(keys, np.stack(columns, axis=1))[:2])
+        self.pending_rows += len(self.pending[-1][0])
+        if self.pending_rows > 4 * max(len(self.keys), MERGE_ROWS):
+            self._merge()
+
+    def _merge(self):
+        if not self.pending:
+            return
+        parts = [(self.keys, self.sums)] + self.pending
+        self.keys, self.sums, _ = regroup(np.concatenate([k for k, _ in parts]), np.concatenate([s for _, s in parts]))
+        self.pending = []
+        self.pending_rows = 0
+
+    def result(self):
+        """
+        Returns:
+            tuple: (keys, sums) arrays sorted by key, keys has one column per key
+                   array, sums has the sample count then the value sums.
+        """
+        self._merge()
+        return self.keys, self.sums
+
+
+# Sum rows of an aggregated result again over a coarser key
+def regroup(keys, sums):
+    """
+    Args:
+        keys (np.ndarray): 1-D or 2-D int64 keys, one row per input row.
+        sums (np.ndarray): 2-D sums to add up per key.
+
+    Returns:
+        tuple: (unique keys, summed rows, number of input rows per key)
+    """
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    summed = np.zeros((len(unique), sums.shape[1]), dtype=np.int64)
+    for column in range(sums.shape[1]):
+        summed[:, column] = np.bincount(inverse, weights=sums[:, column], minlength=len(unique))
+    return unique, summed, np.bincount(inverse, minlength=len(unique))
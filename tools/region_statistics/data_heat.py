@@ -0,0 +1,114 @@
+import numpy as np
+
+from aggregate import GroupSums, regroup
+from dedup import bit_length
+from spe_reader import HEX, DEC
+
+# Constants
+REGION_SHIFT = 21  # 2MB
+PAGE_SHIFT = 12  # 4K
+PAGES_PER_REGION = 1 << (REGION_SHIFT - PAGE_SHIFT)
+LATENCY_BUCKETS = 10  # <8, 8-15, 16-31, ... 2048+ cycles
+TOP_MISS_PCS = 1000
+
+# Extra spe-parser ldst columns and event flags read for the data side
+DATA_COLUMNS = {"vaddr": HEX, "total_lat": DEC}
+DATA_FLAGS = {"llc_refill": ("event", "LLC-REFILL"), "remote": ("event", "REMOTE-ACCESS")}
+
+# Value columns kept by every aggregate, after the sample count
+VALUES = ["llc_refill", "remote", "latency"]
+
+
+# Power of 2 latency bucket of each sample
+def latency_bucket(latency):
+    return np.clip(bit_length(np.maximum(latency, 0)) - 3, 0, LATENCY_BUCKETS - 1)
+
+
+# Label of a latency bucket
+def latency_label(bucket):
+    if bucket == 0:
+        return "<8"
+    low = 1 << (bucket + 2)
+    return f"{low}+" if bucket == LATENCY_BUCKETS - 1 else f"{low}-{2 * low - 1}"
+
+
+class DataHeat:
+    """
+    Data side of the ldst samples: where the accessed data lives (2MB regions
+    and 4K pages), how long the accesses took and which code regions and PCs
+    caused the SLC (LLC-REFILL) and remote (REMOTE-ACCESS) misses.
+    """
+
+    def __init__(self):
+        self.pages = GroupSums(num_values=len(VALUES))
+        self.histogram = GroupSums(num_keys=2)
+        self.code_regions = GroupSums(num_values=len(VALUES))
+        self.pcs = GroupSums(num_values=len(VALUES))
+
+    def add(self, chunk):
+        """
+        Args:
+            chunk (dict): SpeCsvReader chunk with pc, vaddr, total_lat and the DATA_FLAGS.
+        """
+        values = [chunk["llc_refill"], chunk["remote"], chunk["total_lat"]]
+        self.code_regions.add([chunk["pc"] >> np.uint64(REGION_SHIFT)], values)
+        # Instructions are 4 byte aligned, the shift keeps kernel PCs in the int64 keys
+        self.pcs.add([chunk["pc"] >> np.uint64(2)], values)
+
+        # Records without a data address only count on the code side
+        data = chunk["vaddr"] != 0
+        self.pages.add([chunk["vaddr"][data] >> np.uint64(PAGE_SHIFT)], [v[data] for v in values])
+        self.histogram.add([chunk["vaddr"][data] >> np.uint64(REGION_SHIFT), latency_bucket(chunk["total_lat"][data])])
+
+    def result(self):
+        """
+        Returns:
+            dict: "regions" rows (region, samples, llc_refill, remote, avg_latency,
+                  page_touch_ratio), "pages" rows (page, samples, llc_refill, remote,
+                  avg_latency), "histogram" rows (region, counts per latency bucket),
+                  "code_regions" rows (region, samples, llc_refill, remote, avg_latency),
+                  "miss_pcs" rows (pc, samples, llc_refill, remote, avg_latency) of the
+                  TOP_MISS_PCS PCs with most misses, and "summary".
+        """
+        page_keys, page_sums = self.pages.result()
+        pages = page_keys[:, 0]
+        regions, region_sums, region_pages = regroup(pages >> (REGION_SHIFT - PAGE_SHIFT), page_sums)
+
+        histogram_keys, histogram_sums = self.histogram.result()
+        histogram = np.zeros((len(regions), LATENCY_BUCKETS), dtype=np.int64)
+        histogram[np.searchsorted(regions, histogram_keys[:, 0]), histogram_keys[:, 1]] = histogram_sums[:, 0]
+
+        code_keys, code_sums = self.code_regions.result()
+        pc_keys, pc_sums = self.pcs.result()
+        misses = pc_sums[:, 1] + pc_sums[:, 2]
+        top = np.flatnonzero(misses)
+        top = top[np.lexsort((-pc_sums[top, 1], -pc_sums[top, 2]))][:TOP_MISS_PCS]
+
+        def rows(keys, shift, sums):
+            addresses = (keys.astype(np.uint64) << np.uint64(shift)).tolist()
+            return [(address, samples, refill, remote, latency / samples if samples else 0.0)
+                    for address, (samples, refill, remote, latency) in zip(addresses, sums.tolist())]
+
+        samples, refill, remote, latency = code_sums.sum(axis=0).tolist()
+        summary = {
+            "samples": samples,
+            "data_samples": int(page_sums[:, 0].sum()),
+            "llc_refill": refill,
+            "remote": remote,
+            "llc_refill_ratio": round(refill / samples, 4) if samples else 0.0,
+            "remote_ratio": round(remote / samples, 4) if samples else 0.0,
+            "avg_latency": round(latency / samples, 2) if samples else 0.0,
+            "data_regions": len(regions),
+            "data_pages": len(pages),
+            "miss_pcs": int(np.count_nonzero(misses)),
+        }
+
+        region_rows = rows(regions, REGION_SHIFT, region_sums)
+        return {
+            "regions": [row + (touched / PAGES_PER_REGION,) for row, touched in zip(region_rows, region_pages.tolist())],
+            "pages": rows(pages, PAGE_SHIFT, page_sums),
+            "histogram": [(row[0], counts) for row, counts in zip(region_rows, histogram.tolist())],
+            "code_regions": rows(code_keys[:, 0], REGION_SHIFT, code_sums),
+            "miss_pcs": rows(pc_keys[top, 0], 2, pc_sums[top]),
+            "summary": summary,
+        }
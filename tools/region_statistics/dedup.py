@@ -0,0 +1,235 @@
+import os
+import logging
+import tempfile
+
+import numpy as np
+
+from spe_reader import iter_hex_values, format_hex_lines
+
+# Constants
+MB = 1024 * 1024
+DEFAULT_MEMORY_BUDGET = 1024 * MB
+MERGE_BLOCK = 1 * MB  # values read per spill file and merge step
+
+
+class ExternalUniq:
+    """
+    Sorted set of uint64 values with a memory budget.
+
+    Values are deduplicated in memory with np.unique. When the kept values
+    exceed the budget they are spilled as a sorted run to a temporary file,
+    and the runs are merged block by block at the end, so the output is the
+    same as the in-memory result.
+
+    Args:
+        memory_budget (int): Bytes of values kept in memory before spilling.
+        spill_dir (str): Folder for the spill files, None for the system default.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.pending = []
+        self.pending_bytes = 0
+        self.runs = []
+        self.tmpdir = None
+
+    def add(self, values):
+        values = np.unique(values)
+        self.pending.append(values)
+        self.pending_bytes += values.nbytes
+        if self.pending_bytes > self.memory_budget:
+            self._compact()
+
+    def _compact(self):
+        merged = np.unique(np.concatenate(self.pending))
+        self.pending = [merged]
+        self.pending_bytes = merged.nbytes
+        # Still more than half of the budget after dedup: spill a sorted run
+        if self.pending_bytes > self.memory_budget // 2:
+            self._spill(merged)
+
+    def _spill(self, values):
+        if self.tmpdir is None:
+            self.tmpdir = tempfile.TemporaryDirectory(prefix="spe-dedup-", dir=self.spill_dir)
+        run_file = os.path.join(self.tmpdir.name, f"run-{len(self.runs)}.u64")
+        values.tofile(run_file)
+        self.runs.append(run_file)
+        logging.info(f"Spilled {len(values)} values to {run_file}")
+        self.pending = []
+        self.pending_bytes = 0
+
+    def blocks(self):
+        """Yield sorted, globally unique uint64 blocks."""
+        if not self.runs:
+            if self.pending:
+                yield np.unique(np.concatenate(self.pending))
+            return
+
+        # The values left in memory are the last run, however few they are
+        if self.pending:
+            self._spill(np.unique(np.concatenate(self.pending)))
+
+        try:
+            yield from self._merge_runs()
+        finally:
+            self.tmpdir.cleanup()
+            self.tmpdir = None
+            self.runs = []
+
+    def _merge_runs(self):
+        files = [open(run, "rb") for run in self.runs]
+        try:
+            blocks = [np.fromfile(f, dtype=np.uint64, count=MERGE_BLOCK) for f in files]
+            last = None
+            while any(len(b) for b in blocks):
+                # Everything up to the smallest block end is final in all runs
+                bound = min(b[-1] for b in blocks if len(b))
+                parts = []
+                for i, block in enumerate(blocks):
+                    cut = np.searchsorted(block, bound, side="right")
+                    parts.append(block[:cut])
+                    blocks[i] = block[cut:]
+                    if len(blocks[i]) == 0:
+                        blocks[i] = np.fromfile(files[i], dtype=np.uint64, count=MERGE_BLOCK)
+                merged = np.unique(np.concatenate(parts))
+                if last is not None and len(merged) and merged[0] == last:
+                    merged = merged[1:]
+                if len(merged):
+                    last = merged[-1]
+                    yield merged
+        finally:
+            for f in files:
+                f.close()
+
+
+# Sort and deduplicate an address file within a memory budget
+def sort_and_deduplicate_file(input_file, output_file, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=None):
+    """
+    Args:
+        input_file (str): File with one hex address per line.
+        output_file (str): Output file, addresses sorted numerically, one per line.
+        memory_budget (int): Bytes of addresses kept in memory before spilling to disk.
+        spill_dir (str): Folder for spill files, defaults to the output folder.
+
+    Returns:
+        int: Number of unique addresses written.
+    """
+    prefix = detect_prefix(input_file)
+    uniq = ExternalUniq(memory_budget, spill_dir or os.path.dirname(os.path.abspath(output_file)))
+    for values in iter_hex_values(input_file):
+        uniq.add(values)
+
+    count = 0
+    with open(output_file, "wb") as outfile:
+        for block in uniq.blocks():
+            outfile.write(format_hex_lines(block, prefix))
+            count += len(block)
+    return count
+
+
+# Keep the 0x prefix style of the input file
+def detect_prefix(input_file):
+    with open(input_file, "rb") as infile:
+        first = infile.readline()
+    return "0x" if first[:2].lower() == b"0x" else ""
+
+
+# 64 bit mixing hash (splitmix64 finalizer), vectorized
+def hash64(values, seed=0):
+    x = np.asarray(values, dtype=np.uint64) + np.uint64(0x9e3779b97f4a7c15 * (seed + 1) & 0xffffffffffffffff)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+# Number of bits needed to represent each value, vectorized
+def bit_length(values):
+    values = np.asarray(values, dtype=np.uint64)
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = (values >> np.uint64(shift)) != 0
+        values = np.where(high, values >> np.uint64(shift), values)
+        length += high * shift
+    return length + (values != 0)
+
+
+class HyperLogLog:
+    """Cardinality estimate of uint64 values with 2^precision registers."""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        h = hash64(values)
+        index = (h >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest_bits = 64 - self.precision
+        rest = h & np.uint64((1 << rest_bits) - 1)
+        rank = (rest_bits - bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if raw <= 2.5 * m and zeros:
+            return m * np.log(m / zeros)
+        return raw
+
+
+class CountMinSketch:
+    """Approximate count of uint64 values, never below the real count."""
+
+    def __init__(self, width=1 << 20, depth=4):
+        self.width = width
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+
+    def _columns(self, values, row):
+        return (hash64(values, row + 1) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, values):
+        for row in range(len(self.table)):
+            self.table[row] += np.bincount(self._columns(values, row), minlength=self.width).astype(np.uint32)
+
+    def query(self, values):
+        return np.min([self.table[row][self._columns(values, row)] for row in range(len(self.table))], axis=0)
+
+
+# Approximate dedup: estimated cardinality plus the hottest addresses
+def approximate_hot_addresses(input_file, output_file, top):
+    """
+    Keep only the `top` hottest addresses, estimated with a count-min sketch,
+    and estimate the number of unique addresses with HyperLogLog. Memory is
+    bounded by the sketches and 2 * top candidates.
+
+    Args:
+        input_file (str): File with one hex address per line.
+        output_file (str): Output file, the hottest addresses sorted numerically.
+        top (int): Number of addresses to keep.
+
+    Returns:
+        tuple: (addresses written, estimated unique addresses)
+    """
+    prefix = detect_prefix(input_file)
+    hll = HyperLogLog()
+    cms = CountMinSketch()
+    candidates = np.empty(0, dtype=np.uint64)
+
+    for values in iter_hex_values(input_file):
+        hll.add(values)
+        cms.add(values)
+        candidates = np.union1d(candidates, values)
+        if len(candidates) > 2 * top:
+            counts = cms.query(candidates)
+            candidates = candidates[np.argpartition(-counts.astype(np.int64), top)[:top]]
+
+    if len(candidates) > top:
+        counts = cms.query(candidates)
+        candidates = candidates[np.argpartition(-counts.astype(np.int64), top)[:top]]
+    candidates = np.sort(candidates)
+
+    with open(output_file, "wb") as outfile:
+        outfile.write(format_hex_lines(candidates, prefix))
+    return len(candidates), int(round(hll.estimate()))
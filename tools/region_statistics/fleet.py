@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import csv
+import glob
+import json
+import sqlite3
+import argparse
+import logging
+
+import numpy as np
+
+from aggregate import regroup
+
+# Constants
+SUMMARY_VERSION = 1
+SUMMARY_PATTERN = "spe-region-summary.*.json"
+REGION_SHIFT = 21
+CACHELINE_SHIFT = 6
+BLOCK_1K_SHIFT = 10
+TOP_BRANCH_PAIRS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE,
+    mtime REAL,
+    host TEXT,
+    name TEXT,
+    pid INTEGER,
+    captured REAL
+);
+CREATE TABLE IF NOT EXISTS spaces (
+    run_id INTEGER,
+    space TEXT,
+    samples INTEGER,
+    regions INTEGER,
+    unique_cachelines INTEGER
+);
+CREATE TABLE IF NOT EXISTS regions (
+    run_id INTEGER,
+    space TEXT,
+    region INTEGER,
+    samples INTEGER,
+    cacheline_touch_ratio REAL,
+    touch_ratio_1k REAL
+);
+CREATE TABLE IF NOT EXISTS branches (
+    run_id INTEGER,
+    space TEXT,
+    src_region INTEGER,
+    dst_region INTEGER,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_host ON runs (host);
+CREATE INDEX IF NOT EXISTS regions_run ON regions (run_id, space);
+CREATE INDEX IF NOT EXISTS regions_region ON regions (space, region);
+CREATE INDEX IF NOT EXISTS branches_run ON branches (run_id, space);
+"""
+
+
+# Build the summary record of one space (user/kernel) from cacheline sample counts
+def summarize_space(lines, counts, branch_counts):
+    """
+    Args:
+        lines (np.ndarray): Cacheline numbers (address >> 6), may repeat.
+        counts (np.ndarray): Samples of each entry in lines.
+        branch_counts (dict): (pc_region, br_tgt_region) -> count of taken branches.
+
+    Returns:
+        dict: Samples, unique cachelines, per-region [region, samples, cacheline
+              touch ratio, 1K touch ratio] rows and the top branch pairs.
+    """
+    line_ids, line_samples, _ = regroup(np.asarray(lines, dtype=np.int64), np.asarray(counts, dtype=np.int64).reshape(-1, 1))
+    regions, region_samples, region_lines = regroup(line_ids >> (REGION_SHIFT - CACHELINE_SHIFT), line_samples)
+    blocks = np.unique(line_ids >> (BLOCK_1K_SHIFT - CACHELINE_SHIFT))
+    _, _, region_blocks = regroup(blocks >> (REGION_SHIFT - BLOCK_1K_SHIFT), np.zeros((len(blocks), 1), dtype=np.int64))
+
+    lines_per_region = 1 << (REGION_SHIFT - CACHELINE_SHIFT)
+    blocks_per_region = 1 << (REGION_SHIFT - BLOCK_1K_SHIFT)
+    region_rows = [[region << REGION_SHIFT, samples, round(touched / lines_per_region, 6), round(touched_1k / blocks_per_region, 6)]
+                   for region, samples, touched, touched_1k in zip(regions.tolist(), region_samples[:, 0].tolist(),
+                                                                   region_lines.tolist(), region_blocks.tolist())]
+    top = sorted((branch_counts or {}).items(), key=lambda item: -item[1])[:TOP_BRANCH_PAIRS]
+    return {
+        "samples": int(line_samples.sum()),
+        "unique_cachelines": len(line_ids),
+        "regions": region_rows,
+        "branches": [[int(src), int(dst), int(count)] for (src, dst), count in top],
+    }
+
+
+# Save the summary record of a run
+def write_summary(output_file, host, name, pid, captured, spaces):
+    """
+    Args:
+        output_file (str): Output file (spe-region-summary.<file>.json).
+        host (str): Profiled host.
+        name (str): Capture name (the perf.data file).
+        pid (int): Profiled pid, 0 if unknown.
+        captured (float): Capture time in seconds since epoch.
+        spaces (dict): summarize_space record per space ("user", "kernel").
+    """
+    record = {"version": SUMMARY_VERSION, "host": host, "name": name, "pid": pid, "captured": captured, "spaces": spaces}
+    with open(output_file, "w") as outfile:
+        json.dump(record, outfile, separators=(",", ":"))
+
+
+# SQLite integers are signed 64 bit, kernel addresses are stored wrapped
+def to_db(address):
+    return address - (1 << 64) if address >= 1 << 63 else address
+
+
+def from_db(value):
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+
+def connect(db_file):
+    db = sqlite3.connect(db_file)
+    db.executescript(SCHEMA)
+    return db
+
+
+# Add new or changed summary files to the index
+def index_summaries(db, paths):
+    """
+    Args:
+        db (sqlite3.Connection): Index database.
+        paths (list): Summary files, or folders searched recursively for them.
+
+    Returns:
+        tuple: (runs indexed, runs skipped as unchanged)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "**", SUMMARY_PATTERN), recursive=True))
+        else:
+            files.append(path)
+
+    known = dict(db.execute("SELECT source, mtime FROM runs"))
+    indexed = skipped = 0
+    with db:
+        for summary_file in files:
+            source = os.path.abspath(summary_file)
+            mtime = os.path.getmtime(summary_file)
+            if known.get(source) == mtime:
+                skipped += 1
+                continue
+            try:
+                with open(summary_file, "r") as infile:
+                    record = json.load(infile)
+                if record.get("version") != SUMMARY_VERSION:
+                    raise ValueError(f"unsupported version {record.get('version')}")
+                run = (source, mtime, record["host"], record["name"], record["pid"], record["captured"])
+                spaces = [((space, data["samples"], len(data["regions"]), data["unique_cachelines"]),
+                           [(space, to_db(region), samples, ratio, ratio_1k) for region, samples, ratio, ratio_1k in data["regions"]],
+                           [(space, to_db(src), to_db(dst), count) for src, dst, count in data["branches"]])
+                          for space, data in record["spaces"].items()]
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                logging.warning(f"Skipped {summary_file}, not a valid summary: {e!r}")
+                continue
+
+            # A changed file replaces its old run
+            for (run_id,) in db.execute("SELECT id FROM runs WHERE source = ?", (source,)).fetchall():
+                for table in ("spaces", "regions", "branches"):
+                    db.execute(f"DELETE FROM {table} WHERE run_id = ?", (run_id,))
+                db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+            run_id = db.execute("INSERT INTO runs (source, mtime, host, name, pid, captured) VALUES (?, ?, ?, ?, ?, ?)",
+                                run).lastrowid
+            for space_row, region_rows, branch_rows in spaces:
+                db.execute("INSERT INTO spaces VALUES (?, ?, ?, ?, ?)", (run_id,) + space_row)
+                db.executemany("INSERT INTO regions VALUES (?, ?, ?, ?, ?, ?)", [(run_id,) + row for row in region_rows])
+                db.executemany("INSERT INTO branches VALUES (?, ?, ?, ?, ?)", [(run_id,) + row for row in branch_rows])
+            indexed += 1
+    return indexed, skipped
+
+
+# Runs with more than a number of hot regions
+def query_hosts(db, space, min_regions, min_samples):
+    return db.execute(
+        "SELECT runs.host, runs.name, runs.captured, COUNT(*) AS hot_regions, SUM(regions.samples) AS samples "
+        "FROM regions JOIN runs ON runs.id = regions.run_id "
+        "WHERE regions.space = ? AND regions.samples >= ? "
+        "GROUP BY regions.run_id HAVING COUNT(*) > ? ORDER BY hot_regions DESC",
+        (space, min_samples, min_regions))
+
+
+# Hottest regions across the fleet
+def query_regions(db, space, top, host=None):
+    where, params = ("AND runs.host = ?", (space, host, top)) if host else ("", (space, top))
+    return db.execute(
+        "SELECT regions.region, SUM(regions.samples) AS samples, COUNT(DISTINCT runs.host) AS hosts, "
+        "COUNT(*) AS runs, AVG(regions.cacheline_touch_ratio) AS avg_cacheline_touch_ratio "
+        "FROM regions JOIN runs ON runs.id = regions.run_id "
+        f"WHERE regions.space = ? {where} GROUP BY regions.region ORDER BY samples DESC LIMIT ?",
+        params)
+
+
+# Most frequent branch pairs across the fleet
+def query_branches(db, space, top):
+    return db.execute(
+        "SELECT src_region, dst_region, SUM(count) AS count, COUNT(DISTINCT runs.host) AS hosts "
+        "FROM branches JOIN runs ON runs.id = branches.run_id "
+        "WHERE branches.space = ? GROUP BY src_region, dst_region ORDER BY count DESC LIMIT ?",
+        (space, top))
+
+
+# Print query results as CSV, region columns in hex
+def print_rows(cursor):
+    columns = [column[0] for column in cursor.description]
+    writer = csv.writer(sys.stdout)
+    writer.writerow(columns)
+    for row in cursor:
+        writer.writerow([f"0x{from_db(value):x}" if column in ("region", "src_region", "dst_region") and isinstance(value, int) else value
+                         for column, value in zip(columns, row)])
+
+
+# Main execution
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Index spe-region.py summaries of many runs and query them.")
+    parser.add_argument("db_file", help="SQLite index file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index = subparsers.add_parser("index", help=f"Add summary files ({SUMMARY_PATTERN}) or folders of them")
+    index.add_argument("paths", nargs="+", help="Summary files or folders")
+    hosts = subparsers.add_parser("hosts", help="Runs with more than N hot 2MB regions")
+    hosts.add_argument("-n", "--min-regions", type=int, default=0, help="Minimum number of hot regions (default: 0)")
+    hosts.add_argument("-s", "--min-samples", type=int, default=1, help="Samples for a region to be hot (default: 1)")
+    regions = subparsers.add_parser("regions", help="Hottest 2MB regions across all runs")
+    regions.add_argument("-t", "--top", type=int, default=20, help="Number of regions (default: 20)")
+    regions.add_argument("--host", help="Only this host")
+    branches = subparsers.add_parser("branches", help="Most frequent branch region pairs across all runs")
+    branches.add_argument("-t", "--top", type=int, default=20, help="Number of pairs (default: 20)")
+    sql = subparsers.add_parser("sql", help="Run an SQL query (tables: runs, spaces, regions, branches)")
+    sql.add_argument("query", help="SQL query")
+    for subparser in (hosts, regions, branches):
+        subparser.add_argument("-k", "--kernel", action="store_true", help="Kernel space instead of user space")
+    args = parser.parse_args()
+
+    try:
+        db = connect(args.db_file)
+        if args.command == "index":
+            indexed, skipped = index_summaries(db, args.paths)
+            total = db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+            logging.info(f"Indexed {indexed} runs, {skipped} unchanged, {total} runs in {args.db_file}")
+        elif args.command == "sql":
+            print_rows(db.execute(args.query))
+        else:
+            space = "kernel" if args.kernel else "user"
+            if args.command == "hosts":
+                print_rows(query_hosts(db, space, args.min_regions, args.min_samples))
+            elif args.command == "regions":
+                print_rows(query_regions(db, space, args.top, args.host))
+            else:
+                print_rows(query_branches(db, space, args.top))
+        db.close()
+    except sqlite3.Error as e:
+        logging.error(f"Error querying {args.db_file}: {e}")
+        sys.exit(1)
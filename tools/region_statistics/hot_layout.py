@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import csv
+import argparse
+import logging
+
+import numpy as np
+
+from region_map import parse_input_file
+from spe_reader import read_spe_columns, HEX, DEC
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Constants
+MB = 1024 * 1024
+REGION_SIZE = 2 * MB
+CACHELINE_SHIFT = 6
+CACHELINE_SIZE = 1 << CACHELINE_SHIFT
+PAGE_SIZE = 4096
+
+# Read branch samples (pc, br_tgt, taken) out of a spe-parser br CSV
+def read_branch_samples(input_file, el=None):
+    """
+    Read branch records from a spe-parser br CSV into flat integer arrays.
+
+    Args:
+        input_file (str): Path to the spe-<file>-br.csv file.
+        el (str): Exception level to keep ("0" user, "2" kernel), None for all.
+
+    Returns:
+        tuple: (pcs, tgts, taken) numpy arrays. tgts is 0 for not-taken branches.
+    """
+    data, _ = read_spe_columns(input_file, {"pc": HEX, "br_tgt": HEX, "el": DEC},
+                               {"not_taken": ("event", "NOT-TAKEN")})
+    keep = np.ones(len(data["pc"]), dtype=bool) if el is None else data["el"] == int(el)
+    taken = ~data["not_taken"][keep]
+    tgts = np.where(taken, data["br_tgt"][keep], np.uint64(0))
+    return data["pc"][keep], tgts, taken
+
+# Map addresses to graph nodes
+def build_nodes(addresses, functions=None):
+    """
+    Map each address to a graph node. Addresses covered by a perf map
+    function map to that function, everything else to its cacheline.
+
+    Args:
+        addresses (np.ndarray): uint64 addresses to map.
+        functions (list): (address, size, name) tuples from parse_input_file, or None.
+
+    Returns:
+        tuple: (node_ids, node_addr, node_size, node_name) where node_ids
+               indexes into the per-node arrays for each input address.
+    """
+    keys = (addresses >> CACHELINE_SHIFT) << CACHELINE_SHIFT
+    func_starts = np.empty(0, dtype=np.uint64)
+    func_sizes = np.empty(0, dtype=np.uint64)
+    func_names = []
+
+    if functions:
+        functions = sorted(functions)
+        func_starts = np.array([f[0] for f in functions], dtype=np.uint64)
+        func_sizes = np.array([f[1] for f in functions], dtype=np.uint64)
+        func_names = [f[2] for f in functions]
+
+        idx = np.searchsorted(func_starts, addresses, side="right") - 1
+        valid = idx >= 0
+        idx_clipped = np.where(valid, idx, 0)
+        resolved = valid & (addresses < func_starts[idx_clipped] + func_sizes[idx_clipped])
+        keys = np.where(resolved, func_starts[idx_clipped], keys)
+        logging.info(f"Resolved {np.count_nonzero(resolved)}/{len(addresses)} addresses to perf map symbols")
+
+    node_addr, node_ids = np.unique(keys, return_inverse=True)
+    node_size = np.full(len(node_addr), CACHELINE_SIZE, dtype=np.uint64)
+    node_name = [f"0x{addr:x}" for addr in node_addr.tolist()]
+
+    if len(func_starts):
+        pos = np.searchsorted(func_starts, node_addr)
+        pos_clipped = np.minimum(pos, len(func_starts) - 1)
+        is_func = (pos < len(func_starts)) & (func_starts[pos_clipped] == node_addr)
+        node_size[is_func] = np.maximum(func_sizes[pos_clipped[is_func]], 1)
+        for i in np.flatnonzero(is_func).tolist():
+            node_name[i] = func_names[pos_clipped[i]]
+
+    return node_ids.astype(np.int64), node_addr, node_size, node_name
+
+# Aggregate taken branches into weighted edges between nodes
+def build_edges(src_ids, dst_ids):
+    """
+    Collapse per-sample (src, dst) node pairs into unique weighted edges.
+
+    Args:
+        src_ids (np.ndarray): Source node index of each taken branch.
+        dst_ids (np.ndarray): Target node index of each taken branch.
+
+    Returns:
+        tuple: (edge_src, edge_dst, edge_weight) numpy arrays.
+    """
+    packed = (src_ids.astype(np.uint64) << np.uint64(32)) | dst_ids.astype(np.uint64)
+    packed, weights = np.unique(packed, return_counts=True)
+    edge_src = (packed >> np.uint64(32)).astype(np.int64)
+    edge_dst = (packed & np.uint64(0xffffffff)).astype(np.int64)
+    return edge_src, edge_dst, weights.astype(np.int64)
+
+# Select the hottest nodes covering the requested share of samples
+def select_hot_nodes(node_heat, coverage):
+    """
+    Args:
+        node_heat (np.ndarray): Sample count of each node.
+        coverage (float): Share of total heat the hot set must cover (0-1].
+
+    Returns:
+        np.ndarray: Boolean mask of hot nodes.
+    """
+    order = np.argsort(-node_heat, kind="stable")
+    cumulative = np.cumsum(node_heat[order])
+    cutoff = np.searchsorted(cumulative, coverage * cumulative[-1]) + 1
+    hot = np.zeros(len(node_heat), dtype=bool)
+    hot[order[:cutoff]] = True
+    return hot
+
+# Compute a hot code ordering with C3 (call-chain clustering)
+def c3_order(node_heat, node_size, edge_src, edge_dst, edge_weight, max_cluster_size):
+    """
+    Order nodes with the C3 heuristic: walk callees from hottest to coldest,
+    append each callee's cluster to the cluster of its heaviest caller while
+    the merged cluster fits in max_cluster_size, then sort clusters by
+    density (heat per byte).
+
+    Args:
+        node_heat (np.ndarray): Sample count of each node.
+        node_size (np.ndarray): Size in bytes of each node.
+        edge_src, edge_dst, edge_weight (np.ndarray): Weighted edges.
+        max_cluster_size (int): Upper bound of a cluster size in bytes.
+
+    Returns:
+        tuple: (order, cluster) where order lists node indices in layout
+               order and cluster gives the cluster id of each node.
+    """
+    num_nodes = len(node_heat)
+
+    # Heaviest caller of every callee, ignoring self loops
+    mask = edge_src != edge_dst
+    src, dst, weight = edge_src[mask], edge_dst[mask], edge_weight[mask]
+    best_caller = np.full(num_nodes, -1, dtype=np.int64)
+    if len(dst):
+        sort_idx = np.lexsort((-weight, dst))
+        dst_sorted = dst[sort_idx]
+        _, first = np.unique(dst_sorted, return_index=True)
+        best_caller[dst_sorted[first]] = src[sort_idx][first]
+
+    cluster_of = np.arange(num_nodes)
+    members = [[i] for i in range(num_nodes)]
+    cluster_size = node_size.astype(np.int64)
+    cluster_heat = node_heat.astype(np.int64)
+
+    for callee in np.argsort(-node_heat, kind="stable").tolist():
+        caller = best_caller[callee]
+        if caller < 0:
+            continue
+        a = cluster_of[caller]
+        b = cluster_of[callee]
+        if a == b or cluster_size[a] + cluster_size[b] > max_cluster_size:
+            continue
+        cluster_of[members[b]] = a
+        members[a].extend(members[b])
+        members[b] = []
+        cluster_size[a] += cluster_size[b]
+        cluster_heat[a] += cluster_heat[b]
+
+    roots = np.flatnonzero(cluster_of == np.arange(num_nodes))
+    density = cluster_heat[roots] / np.maximum(cluster_size[roots], 1)
+    roots = roots[np.argsort(-density, kind="stable")]
+    order = np.array([m for root in roots.tolist() for m in members[root]], dtype=np.int64)
+    return order, cluster_of
+
+# Count distinct 2MB regions touched by a set of code spans
+def count_regions(starts, sizes):
+    first = starts // REGION_SIZE
+    last = (starts + np.maximum(sizes, 1) - 1) // REGION_SIZE
+    return len(np.unique(np.concatenate([first, last])))
+
+# Compare the current layout with the recommended one
+def estimate_layout(order, node_addr, node_size, edge_src, edge_dst, edge_weight):
+    """
+    Estimate touched 2MB regions and cross-region jumps before and after
+    placing the nodes in `order` contiguously from a 2MB aligned base.
+
+    Returns:
+        dict: Before/after figures of the hot set.
+    """
+    addr = node_addr.astype(np.int64)
+    size = node_size.astype(np.int64)
+
+    new_addr = np.zeros(len(node_addr), dtype=np.int64)
+    new_addr[order] = np.concatenate([[0], np.cumsum(size[order])[:-1]])
+
+    def cross_region(addresses):
+        regions = addresses // REGION_SIZE
+        return int(edge_weight[regions[edge_src] != regions[edge_dst]].sum())
+
+    return {
+        "hot_nodes": len(order),
+        "hot_footprint_bytes": int(size[order].sum()),
+        "taken_branches": int(edge_weight.sum()),
+        "regions_before": count_regions(addr[order], size[order]),
+        "regions_after": count_regions(new_addr[order], size[order]),
+        "cross_region_jumps_before": cross_region(addr),
+        "cross_region_jumps_after": cross_region(new_addr),
+    }
+
+# Build the branch graph and compute the recommended layout
+def recommend_layout(pcs, tgts, taken, functions=None, coverage=0.99, max_cluster_size=PAGE_SIZE):
+    """
+    Args:
+        pcs, tgts, taken (np.ndarray): Branch samples from read_branch_samples.
+        functions (list): perf map functions, or None for cacheline granularity.
+        coverage (float): Share of samples the hot set must cover.
+        max_cluster_size (int): Upper bound of a C3 cluster size in bytes.
+
+    Returns:
+        tuple: (rows, summary). rows are (rank, cluster, name, size, heat,
+               old_addr, new_offset) in layout order.
+    """
+    # Heat counts every sampled pc plus every taken branch landing in a node
+    addresses = np.concatenate([pcs, tgts[taken]])
+    node_ids, node_addr, node_size, node_name = build_nodes(addresses, functions)
+    node_heat = np.bincount(node_ids, minlength=len(node_addr))
+
+    src_ids = node_ids[:len(pcs)][taken]
+    dst_ids = node_ids[len(pcs):]
+    edge_src, edge_dst, edge_weight = build_edges(src_ids, dst_ids)
+    logging.info(f"Built branch graph: {len(node_addr)} nodes, {len(edge_src)} edges")
+
+    # Restrict the graph to the hot set
+    hot = select_hot_nodes(node_heat, coverage)
+    hot_idx = np.flatnonzero(hot)
+    remap = np.full(len(node_addr), -1, dtype=np.int64)
+    remap[hot_idx] = np.arange(len(hot_idx))
+    keep = hot[edge_src] & hot[edge_dst]
+    hot_src, hot_dst, hot_weight = remap[edge_src[keep]], remap[edge_dst[keep]], edge_weight[keep]
+
+    order, cluster_of = c3_order(node_heat[hot_idx], node_size[hot_idx], hot_src, hot_dst, hot_weight, max_cluster_size)
+    summary = estimate_layout(order, node_addr[hot_idx], node_size[hot_idx], hot_src, hot_dst, hot_weight)
+
+    rows = []
+    offset = 0
+    for rank, i in enumerate(order.tolist()):
+        node = hot_idx[i]
+        size = int(node_size[node])
+        rows.append((rank, int(cluster_of[i]), node_name[node], size, int(node_heat[node]), int(node_addr[node]), offset))
+        offset += size
+    return rows, summary
+
+# Write the layout and its summary
+def write_layout(rows, summary, output_file, summary_file):
+    with open(output_file, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["rank", "cluster", "name", "size", "heat", "old_addr", "new_offset"])
+        for rank, cluster, name, size, heat, old_addr, new_offset in rows:
+            writer.writerow([rank, cluster, name, size, heat, f"0x{old_addr:x}", f"0x{new_offset:x}"])
+
+    with open(summary_file, "w") as outfile:
+        for key, value in summary.items():
+            outfile.write(f"{key}: {value}\n")
+
+    logging.info(f"Layout saved to {output_file}, summary saved to {summary_file}")
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommend a hot code layout from SPE branch samples.")
+    parser.add_argument("br_csv", help="Path to the spe-<file>-br.csv file generated by spe-parser")
+    parser.add_argument("-m", "--perf-map", help="perf map file (/tmp/perf-<pid>.map) for function granularity")
+    parser.add_argument("-e", "--el", default="0", help="Exception level to analyze, 0 user or 2 kernel (default: 0)")
+    parser.add_argument("-c", "--coverage", type=float, default=0.99, help="Share of samples covered by the hot set (default: 0.99)")
+    parser.add_argument("-s", "--cluster-size", type=int, default=PAGE_SIZE, help="Max cluster size in bytes (default: 4096)")
+    parser.add_argument("-o", "--output", help="Output name tag (default: derived from br_csv)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.br_csv):
+        logging.error(f"File not found: {args.br_csv}")
+        sys.exit(1)
+
+    tag = args.output or os.path.basename(args.br_csv).rsplit(".", 1)[0]
+    functions = parse_input_file(args.perf_map) if args.perf_map else None
+
+    pcs, tgts, taken = read_branch_samples(args.br_csv, args.el)
+    if len(pcs) == 0:
+        logging.error(f"No branch samples with el={args.el} in {args.br_csv}")
+        sys.exit(1)
+
+    # User and kernel layouts of the same capture are kept apart, like br.<file>.csv and br-kernel.<file>.csv
+    prefix = {"0": "layout", "2": "layout-kernel"}.get(args.el, f"layout-el{args.el}")
+    rows, summary = recommend_layout(pcs, tgts, taken, functions, args.coverage, args.cluster_size)
+    write_layout(rows, summary, f"{prefix}.{tag}.csv", f"{prefix}-summary.{tag}.txt")
+
+    logging.info(f"Hot set: {summary['hot_nodes']} nodes, {summary['hot_footprint_bytes']} bytes")
+    logging.info(f"2MB regions touched: {summary['regions_before']} -> {summary['regions_after']}")
+    logging.info(f"Cross-region jumps: {summary['cross_region_jumps_before']} -> {summary['cross_region_jumps_after']}")
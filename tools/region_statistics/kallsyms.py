@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+import sys
+import argparse
+import logging
+
+import numpy as np
+
+# Constants
+KALLSYMS_FILE = "/proc/kallsyms"
+MODULES_FILE = "/proc/modules"
+CORE_KERNEL = "vmlinux"
+CODE_TYPES = "tTwW"
+CACHELINE_SIZE = 64
+LAST_SYMBOL_SIZE = 4096  # kallsyms has no sizes, the last symbol gets a page
+MAX_SYMBOL_SIZE = 1 << 20  # larger gaps to the next symbol are holes, not code
+TEXT_END_SYMBOLS = ("_etext", "_einittext")
+
+
+class KernelSymbols:
+    """
+    Kernel code symbols and modules in sorted arrays, loaded once.
+
+    Symbols come from /proc/kallsyms (code symbols only), the size of a symbol
+    is the distance to the next one. Module ranges come from /proc/modules;
+    everything else belongs to vmlinux. vmlinux symbols end at _etext or
+    _einittext, and symbols without a module range (vmlinux, [bpf], [ftrace]...)
+    get a page at most when the next symbol is in another module or far away. Both files need root to show real
+    addresses (kptr_restrict), use a snapshot for offline analysis.
+    """
+
+    def __init__(self, starts, names, symbol_modules, module_names, module_starts, module_sizes):
+        order = np.argsort(starts, kind="stable")
+        self.starts = np.asarray(starts, dtype=np.uint64)[order]
+        self.names = np.asarray(names)[order]
+        self.symbol_modules = np.asarray(symbol_modules, dtype=np.int64)[order]
+        self.module_names = np.asarray(module_names)
+        self.module_starts = np.asarray(module_starts, dtype=np.uint64)
+        self.module_sizes = np.asarray(module_sizes, dtype=np.uint64)
+
+        # Symbol end: next symbol start, capped by the end of its module
+        ends = np.append(self.starts[1:], self.starts[-1] + np.uint64(LAST_SYMBOL_SIZE)) if len(self.starts) else self.starts
+        module_ends = self.module_starts + self.module_sizes
+        in_module = (self.symbol_modules > 0) & (self.module_sizes[self.symbol_modules] > 0)
+        ends[in_module] = np.minimum(ends[in_module], module_ends[self.symbol_modules[in_module]])
+
+        # vmlinux symbols end at the next text end marker
+        markers = np.sort(self.starts[np.isin(self.names, TEXT_END_SYMBOLS)])
+        if len(markers):
+            next_marker = np.searchsorted(markers, self.starts, side="right")
+            vmlinux = (self.symbol_modules == 0) & (next_marker < len(markers))
+            ends[vmlinux] = np.minimum(ends[vmlinux], markers[next_marker[vmlinux]])
+
+        # Without a module range the gap to another module's symbol, or a huge gap, is not code
+        last_of_module = np.append(self.symbol_modules[1:] != self.symbol_modules[:-1], True)
+        capped = ~in_module & (last_of_module | (ends - self.starts > np.uint64(MAX_SYMBOL_SIZE)))
+        ends[capped] = np.minimum(ends[capped], self.starts[capped] + np.uint64(LAST_SYMBOL_SIZE))
+        self.sizes = np.maximum(ends - self.starts, np.uint64(1))
+
+    @classmethod
+    def from_proc(cls, kallsyms_file=KALLSYMS_FILE, modules_file=MODULES_FILE):
+        module_names = [CORE_KERNEL]
+        module_starts = [0]
+        module_sizes = [0]
+        try:
+            with open(modules_file, "r") as infile:
+                for line in infile:
+                    parts = line.split()
+                    if len(parts) < 6:
+                        continue
+                    module_names.append(parts[0])
+                    module_sizes.append(int(parts[1]))
+                    module_starts.append(int(parts[5], 16))
+        except OSError as e:
+            logging.warning(f"Cannot read {modules_file}: {e}")
+        module_index = {name: i for i, name in enumerate(module_names)}
+
+        starts, names, symbol_modules = [], [], []
+        with open(kallsyms_file, "r") as infile:
+            for line in infile:
+                parts = line.split()
+                if len(parts) < 3 or parts[1] not in CODE_TYPES:
+                    continue
+                module = parts[3].strip("[]") if len(parts) > 3 else CORE_KERNEL
+                if module not in module_index:
+                    module_index[module] = len(module_names)
+                    module_names.append(module)
+                    module_starts.append(0)
+                    module_sizes.append(0)
+                starts.append(int(parts[0], 16))
+                names.append(parts[2])
+                symbol_modules.append(module_index[module])
+
+        if not starts or not any(starts):
+            raise ValueError(f"No symbol addresses in {kallsyms_file}, run as root or use a snapshot")
+        return cls(starts, names, symbol_modules, module_names, module_starts, module_sizes)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_file):
+        data = np.load(snapshot_file)
+        return cls(data["starts"], data["names"], data["symbol_modules"],
+                   data["module_names"], data["module_starts"], data["module_sizes"])
+
+    def save_snapshot(self, snapshot_file):
+        np.savez_compressed(snapshot_file, starts=self.starts, names=self.names,
+                            symbol_modules=self.symbol_modules, module_names=self.module_names,
+                            module_starts=self.module_starts, module_sizes=self.module_sizes)
+
+    def resolve(self, addresses):
+        """
+        Args:
+            addresses (np.ndarray): uint64 kernel addresses.
+
+        Returns:
+            tuple: (symbol, module) index arrays, -1 for unresolved addresses.
+        """
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        symbol = np.searchsorted(self.starts, addresses, side="right") - 1
+        clipped = np.maximum(symbol, 0)
+        valid = (symbol >= 0) & (addresses < self.starts[clipped] + self.sizes[clipped])
+        symbol = np.where(valid, symbol, -1)
+        module = np.where(valid, self.symbol_modules[clipped], -1)
+        return symbol, module
+
+
+# Per-symbol and per-module heat, touch ratio and cross-module branches
+def kernel_attribution(symbols, pcs, pc_counts, br_pcs, br_tgts, br_counts=None):
+    """
+    Args:
+        symbols (KernelSymbols): Resolver.
+        pcs (np.ndarray): Unique sampled kernel PCs.
+        pc_counts (np.ndarray): Samples of each PC.
+        br_pcs, br_tgts (np.ndarray): Taken kernel branches, or unique (pc, br_tgt) pairs with br_counts.
+        br_counts (np.ndarray): Number of taken branches per pair, 1 each when None.
+
+    Returns:
+        dict: "symbols", "modules" and "cross_module" rows, plus "summary".
+    """
+    pc_counts = np.asarray(pc_counts, dtype=np.int64)
+    symbol, module = symbols.resolve(pcs)
+    resolved = symbol >= 0
+    num_symbols = len(symbols.starts)
+    num_modules = len(symbols.module_names)
+
+    symbol_heat = np.bincount(symbol[resolved], weights=pc_counts[resolved], minlength=num_symbols).astype(np.int64)
+    module_heat = np.bincount(module[resolved], weights=pc_counts[resolved], minlength=num_modules).astype(np.int64)
+
+    # Touched cachelines per symbol and per module, a line shared by two symbols counts for both
+    lines = (pcs[resolved] // np.uint64(CACHELINE_SIZE)).astype(np.int64)
+    symbol_line_pairs = np.unique(np.stack([symbol[resolved], lines], axis=1), axis=0)
+    module_line_pairs = np.unique(np.stack([module[resolved], lines], axis=1), axis=0)
+    symbol_lines = np.bincount(symbol_line_pairs[:, 0], minlength=num_symbols)
+    module_lines = np.bincount(module_line_pairs[:, 0], minlength=num_modules)
+    first_line = symbols.starts // np.uint64(CACHELINE_SIZE)
+    last_line = (symbols.starts + symbols.sizes - np.uint64(1)) // np.uint64(CACHELINE_SIZE)
+    symbol_total_lines = (last_line - first_line + np.uint64(1)).astype(np.int64)
+    module_total_lines = np.bincount(symbols.symbol_modules, weights=symbol_total_lines, minlength=num_modules)
+
+    symbol_rows = []
+    for i in np.flatnonzero(symbol_heat).tolist():
+        symbol_rows.append((symbols.names[i], symbols.module_names[symbols.symbol_modules[i]], int(symbols.starts[i]),
+                            int(symbols.sizes[i]), int(symbol_heat[i]), symbol_lines[i] / symbol_total_lines[i]))
+    symbol_rows.sort(key=lambda row: -row[4])
+
+    module_rows = []
+    for i in np.flatnonzero(module_heat).tolist():
+        module_rows.append((symbols.module_names[i], int(module_heat[i]), int(module_lines[i]),
+                            module_lines[i] / module_total_lines[i] if module_total_lines[i] else 0.0))
+    module_rows.sort(key=lambda row: -row[1])
+
+    # Taken branches leaving their module
+    _, src_module = symbols.resolve(br_pcs)
+    _, dst_module = symbols.resolve(br_tgts)
+    br_counts = np.ones(len(br_pcs), dtype=np.int64) if br_counts is None else np.asarray(br_counts, dtype=np.int64)
+    both = (src_module >= 0) & (dst_module >= 0)
+    packed = src_module[both] * num_modules + dst_module[both]
+    pairs, inverse = np.unique(packed, return_inverse=True)
+    counts = np.bincount(inverse.reshape(-1), weights=br_counts[both], minlength=len(pairs)).astype(np.int64)
+    cross_rows = []
+    for pair, count in zip(pairs.tolist(), counts.tolist()):
+        src, dst = divmod(pair, num_modules)
+        if src != dst:
+            cross_rows.append((symbols.module_names[src], symbols.module_names[dst], count))
+    cross_rows.sort(key=lambda row: -row[2])
+
+    summary = {
+        "samples": int(pc_counts.sum()),
+        "resolved_samples": int(pc_counts[resolved].sum()),
+        "hot_symbols": len(symbol_rows),
+        "hot_modules": len(module_rows),
+        # Each mitigation round flushes every unique cacheline once
+        "unique_cachelines": len(np.unique(lines)),
+        "taken_branches": int(br_counts.sum()),
+        "cross_module_branches": int(sum(row[2] for row in cross_rows)),
+    }
+    return {"symbols": symbol_rows, "modules": module_rows, "cross_module": cross_rows, "summary": summary}
+
+
+# Main execution
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Save a snapshot of /proc/kallsyms and /proc/modules for offline analysis.")
+    parser.add_argument("snapshot_file", help="Output snapshot file (.npz)")
+    parser.add_argument("--kallsyms", default=KALLSYMS_FILE, help=f"kallsyms file (default: {KALLSYMS_FILE})")
+    parser.add_argument("--modules", default=MODULES_FILE, help=f"modules file (default: {MODULES_FILE})")
+    args = parser.parse_args()
+
+    try:
+        symbols = KernelSymbols.from_proc(args.kallsyms, args.modules)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error loading kernel symbols: {e}")
+        sys.exit(1)
+    symbols.save_snapshot(args.snapshot_file)
+    logging.info(f"Saved {len(symbols.starts)} symbols of {len(symbols.module_names)} modules to {args.snapshot_file}")
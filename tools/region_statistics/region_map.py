@@ -1,6 +1,11 @@
 #!/usr/bin/python3
 
+import os
+import glob
+import bisect
+import asyncio
 import argparse
+import logging
 import xml.etree.ElementTree as ET
 
 # Constants
@@ -11,23 +16,33 @@ BAR_WIDTH = 40    # Width of each vertical bar
 SPACE_BETWEEN_BARS = 10  # Space between each bar
 TEXT_OFFSET = 5
 BAR_Y_OFFSET = 60
+WATCH_INTERVAL = 1.0  # seconds between polls of the watched map files
+
+# Function to parse one line of a perf map file, None for empty, comment or malformed lines
+def parse_line(line):
+    # Skip empty lines or comments
+    if not line.strip() or line.startswith('#'):
+        return None
+    # Split the line into address, size, and name
+    parts = line.split()
+    if len(parts) < 3:
+        return None  # Skip malformed lines
+    try:
+        address = int(parts[0], 16)  # Convert hex address to integer
+        size = int(parts[1], 16)   # Handle hex or decimal size
+    except ValueError:
+        return None  # Skip lines with invalid numbers
+    name = ' '.join(parts[2:])  # Join the remaining parts as the function name
+    return (address, size, name)
 
 # Function to parse the input file
 def parse_input_file(file_path):
     functions = []
     with open(file_path, 'r') as file:
         for line in file:
-            # Skip empty lines or comments
-            if not line.strip() or line.startswith('#'):
-                continue
-            # Split the line into address, size, and name
-            parts = line.split()
-            if len(parts) < 3:
-                continue  # Skip malformed lines
-            address = int(parts[0], 16)  # Convert hex address to integer
-            size = int(parts[1], 16)   # Handle hex or decimal size
-            name = ' '.join(parts[2:])  # Join the remaining parts as the function name
-            functions.append((address, size, name))
+            function = parse_line(line)
+            if function is not None:
+                functions.append(function)
     return functions
 
 # Function to convert address to segment index
@@ -42,10 +57,10 @@ def calculate_occupancy(segments):
         occupancy[segment_index] = total_size / SEGMENT_SIZE
     return occupancy
 
-# Function to draw the SVG
-def draw_svg(functions, output_svg_path):
+# Function to split functions into per-segment parts
+def split_by_segment(functions, segments=None):
     # Group functions by segment
-    segments = {}
+    segments = {} if segments is None else segments
     for start, size, name in functions:
         while size > 0:
             segment_index = address_to_segment(start)
@@ -62,49 +77,45 @@ def draw_svg(functions, output_svg_path):
 
             start += part_size
             size -= part_size
+    return segments
 
-    # Calculate occupancy ratios
-    occupancy = calculate_occupancy(segments)
+# Function to draw one segment bar at x
+def draw_segment(parent, x, segment_index, funcs, occupancy_ratio):
+    # Draw segment background
+    ET.SubElement(parent, 'rect', x=str(x), y=str(BAR_Y_OFFSET), width=str(BAR_WIDTH), height=str(BAR_HEIGHT), fill='lightgray')
+    
+    # Draw functions within the segment
+    for start, size, name in funcs:
+        y = BAR_HEIGHT - ((start % SEGMENT_SIZE) / SEGMENT_SIZE) * BAR_HEIGHT + BAR_Y_OFFSET    
+        height = (size / SEGMENT_SIZE) * BAR_HEIGHT
+        # Draw function block
+        rect = ET.SubElement(parent, 'rect', x=str(x), y=str(y - height), width=str(BAR_WIDTH), height=str(height), fill='blue')
+        # Add tooltip with function details
+        title = ET.SubElement(rect, 'title')
+        title.text = f"Name: {name}\nAddress: 0x{start:08x}\nSize: {size} bytes"
+
+    # Draw segment label (hex address) at the bottom, vertically aligned
+    segment_start_address = segment_index * SEGMENT_SIZE
+    segment_label = f"0x{segment_start_address:08x}"
+    text = ET.SubElement(parent, 'text', x=str(x + BAR_WIDTH / 2 + 5), y=str(BAR_HEIGHT + BAR_Y_OFFSET + 110), fill='black', 
+                         font_size="16", text_anchor="middle", transform=f"rotate(-90, {x + BAR_WIDTH / 2 + 5}, {BAR_HEIGHT + BAR_Y_OFFSET + 110})")
+    text.text = segment_label
 
+    # Draw occupancy ratio on top of each segment
+    occupancy_text = f"{occupancy_ratio:.1%}"
+    ET.SubElement(parent, 'text', x=str(x), y=str(BAR_Y_OFFSET - 2), fill='black', font_size="10", text_anchor="middle").text = occupancy_text
+
+# Function to create the SVG root element for a number of segments
+def svg_root(num_segments):
     # Calculate total SVG width
-    num_segments = len(segments)
     svg_width = max(num_segments * (BAR_WIDTH + SPACE_BETWEEN_BARS), 240)
     svg_height = BAR_HEIGHT + 220  # Extra space for labels at the bottom
 
     # Create SVG root element
-    svg = ET.Element('svg', width=str(svg_width), height=str(svg_height), xmlns="http://www.w3.org/2000/svg")
-
-    # Sort segments by their start address (segment index)
-    sorted_segments = sorted(segments.items())
-
-    # Draw each segment
-    for i, (segment_index, funcs) in enumerate(sorted_segments):
-        x = i * (BAR_WIDTH + SPACE_BETWEEN_BARS)
-        # Draw segment background
-        ET.SubElement(svg, 'rect', x=str(x), y=str(BAR_Y_OFFSET), width=str(BAR_WIDTH), height=str(BAR_HEIGHT), fill='lightgray')
-        
-        # Draw functions within the segment
-        for start, size, name in funcs:
-            y = BAR_HEIGHT - ((start % SEGMENT_SIZE) / SEGMENT_SIZE) * BAR_HEIGHT + BAR_Y_OFFSET    
-            height = (size / SEGMENT_SIZE) * BAR_HEIGHT
-            # Draw function block
-            rect = ET.SubElement(svg, 'rect', x=str(x), y=str(y - height), width=str(BAR_WIDTH), height=str(height), fill='blue')
-            # Add tooltip with function details
-            title = ET.SubElement(rect, 'title')
-            title.text = f"Name: {name}\nAddress: 0x{start:08x}\nSize: {size} bytes"
-
-        # Draw segment label (hex address) at the bottom, vertically aligned
-        segment_start_address = segment_index * SEGMENT_SIZE
-        segment_label = f"0x{segment_start_address:08x}"
-        text = ET.SubElement(svg, 'text', x=str(x + BAR_WIDTH / 2 + 5), y=str(BAR_HEIGHT + BAR_Y_OFFSET + 110), fill='black', 
-                             font_size="16", text_anchor="middle", transform=f"rotate(-90, {x + BAR_WIDTH / 2 + 5}, {BAR_HEIGHT + BAR_Y_OFFSET + 110})")
-        text.text = segment_label
-
-        # Draw occupancy ratio on top of each segment
-        occupancy_ratio = occupancy.get(segment_index, 0)
-        occupancy_text = f"{occupancy_ratio:.1%}"
-        ET.SubElement(svg, 'text', x=str(x), y=str(BAR_Y_OFFSET - 2), fill='black', font_size="10", text_anchor="middle").text = occupancy_text
+    return ET.Element('svg', width=str(svg_width), height=str(svg_height), xmlns="http://www.w3.org/2000/svg")
 
+# Function to add the title and notes
+def draw_notes(svg):
     # Add chart title at the top center.
     title = ET.SubElement(svg, 'text', x="0", y="20", fill="black", font_size="10", text_anchor="middle")
     title.text = "Code Distribution in 2MB Regions"
@@ -115,24 +126,214 @@ def draw_svg(functions, output_svg_path):
     note1 = ET.SubElement(svg, 'text', x="37", y=str(BAR_HEIGHT + BAR_Y_OFFSET + 160), fill="black", font_size="10", text_anchor="middle")
     note1.text = "The blue blocks (size) only contains main code and stub code of each function"
 
+# Function to draw the SVG
+def draw_svg(functions, output_svg_path):
+    # Group functions by segment
+    segments = split_by_segment(functions)
+
+    # Calculate occupancy ratios
+    occupancy = calculate_occupancy(segments)
+
+    svg = svg_root(len(segments))
+
+    # Sort segments by their start address (segment index)
+    sorted_segments = sorted(segments.items())
+
+    # Draw each segment
+    for i, (segment_index, funcs) in enumerate(sorted_segments):
+        x = i * (BAR_WIDTH + SPACE_BETWEEN_BARS)
+        draw_segment(svg, x, segment_index, funcs, occupancy.get(segment_index, 0))
+
+    draw_notes(svg)
 
     # Save SVG to file
     tree = ET.ElementTree(svg)
     tree.write(output_svg_path, encoding='utf-8', xml_declaration=True)
 
+class MapWatcher:
+    """
+    Incremental segment index of one append-only perf map file.
+
+    Each poll only parses the lines appended since the last one and inserts
+    them into the sorted parts of their segments. The SVG bar and report row
+    of a segment are cached, only the changed segments are drawn again and
+    the outputs are assembled from the cache.
+
+    Args:
+        map_file (str): perf-<pid>.map file to tail.
+        output_dir (str): Folder for perf-<pid>.svg and region-occupancy.perf-<pid>.csv.
+    """
+
+    def __init__(self, map_file, output_dir):
+        self.map_file = map_file
+        name = os.path.splitext(os.path.basename(map_file))[0]
+        self.svg_file = os.path.join(output_dir, f"{name}.svg")
+        self.csv_file = os.path.join(output_dir, f"region-occupancy.{name}.csv")
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        self.offset = 0
+        self.partial = b""
+        self.functions = 0
+        self.segments = {}  # segment index -> parts sorted by start address
+        self.sizes = {}     # segment index -> bytes of code
+        self.bars = {}      # segment index -> cached SVG elements of the bar
+        self.rows = {}      # segment index -> cached report row
+
+    def poll(self):
+        """
+        Returns:
+            set: Segments changed by the lines appended since the last poll.
+        """
+        stat = os.stat(self.map_file)
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # New file (JVM restarted with the same pid) or truncated: start over
+            if self.inode is not None:
+                logging.info(f"{self.map_file} was replaced, reading it again")
+            self.reset()
+            self.inode = stat.st_ino
+        if stat.st_size == self.offset:
+            return set()
+
+        with open(self.map_file, "rb") as infile:
+            infile.seek(self.offset)
+            data = infile.read(stat.st_size - self.offset)
+        self.offset += len(data)
+
+        # Keep the last line until its newline is written
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        functions = []
+        for line in lines:
+            function = parse_line(line.decode(errors="replace"))
+            if function is not None:
+                functions.append(function)
+        self.functions += len(functions)
+
+        changed = split_by_segment(functions)
+        for segment_index, parts in changed.items():
+            segment = self.segments.setdefault(segment_index, [])
+            for part in parts:
+                bisect.insort(segment, part)
+            self.sizes[segment_index] = self.sizes.get(segment_index, 0) + sum(size for _, size, _ in parts)
+        return set(changed)
+
+    def render(self, changed):
+        """
+        Draw the changed segments again and assemble the outputs.
+
+        Returns:
+            tuple: (SVG text, report CSV text)
+        """
+        for segment_index in changed:
+            occupancy = self.sizes[segment_index] / SEGMENT_SIZE
+            bar = ET.Element('g')
+            draw_segment(bar, 0, segment_index, self.segments[segment_index], occupancy)
+            self.bars[segment_index] = "".join(ET.tostring(element, encoding="unicode") for element in bar)
+            self.rows[segment_index] = (f"0x{segment_index * SEGMENT_SIZE:x},{len(self.segments[segment_index])},"
+                                        f"{self.sizes[segment_index]},{occupancy:.4f}\n")
+
+        # Segments are placed with a translation so cached bars don't depend on their position
+        svg = svg_root(len(self.segments))
+        draw_notes(svg)
+        document = ET.tostring(svg, encoding="unicode")
+        head_end = document.index(">") + 1
+        bars = "".join(f'<g transform="translate({i * (BAR_WIDTH + SPACE_BETWEEN_BARS)},0)">{self.bars[segment_index]}</g>'
+                       for i, segment_index in enumerate(sorted(self.segments)))
+        svg_text = "<?xml version='1.0' encoding='utf-8'?>\n" + document[:head_end] + bars + document[head_end:]
+        csv_text = "segment,functions,bytes,occupancy\n" + "".join(self.rows[i] for i in sorted(self.segments))
+        return svg_text, csv_text
+
+    def write(self, svg_text, csv_text):
+        for output_file, text in ((self.svg_file, svg_text), (self.csv_file, csv_text)):
+            with open(output_file + ".tmp", "w", encoding="utf-8") as outfile:
+                outfile.write(text)
+            os.replace(output_file + ".tmp", output_file)
+
+
+# Tail one map file until it disappears or the watch stops
+async def watch_map(watcher, interval, stop):
+    """
+    Reading, parsing and drawing run in worker threads so the event loop keeps
+    tailing the other map files meanwhile. A failed poll is logged and retried
+    at the next interval.
+    """
+    while not stop.is_set():
+        try:
+            changed = await asyncio.to_thread(watcher.poll)
+            if changed:
+                svg_text, csv_text = await asyncio.to_thread(watcher.render, changed)
+                await asyncio.to_thread(watcher.write, svg_text, csv_text)
+                logging.info(f"{watcher.map_file}: {watcher.functions} functions, {len(changed)}/{len(watcher.segments)} "
+                             f"segments changed -> {watcher.svg_file}")
+        except FileNotFoundError:
+            logging.info(f"{watcher.map_file} is gone, stopped watching it")
+            return
+        except Exception as e:
+            logging.error(f"Error updating {watcher.map_file}: {e}")
+
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+# Watch map files matching the patterns, picking up new ones (e.g. new JVMs) as they appear
+async def watch(patterns, output_dir, interval=WATCH_INTERVAL, duration=None):
+    """
+    Args:
+        patterns (list): Map files or glob patterns such as /tmp/perf-*.map.
+        output_dir (str): Folder for the SVG and report of each map file.
+        interval (float): Seconds between polls.
+        duration (float): Stop after this many seconds, None to run until interrupted.
+    """
+    stop = asyncio.Event()
+    if duration is not None:
+        asyncio.get_running_loop().call_later(duration, stop.set)
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = {}
+    watchers = {}  # kept when a map file disappears, a new file with the same name is detected by its inode
+    while not stop.is_set():
+        for pattern in patterns:
+            for map_file in glob.glob(pattern):
+                if map_file not in tasks or tasks[map_file].done():
+                    logging.info(f"Watching {map_file}")
+                    watcher = watchers.setdefault(map_file, MapWatcher(map_file, output_dir))
+                    tasks[map_file] = asyncio.create_task(watch_map(watcher, interval, stop))
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    await asyncio.gather(*tasks.values())
+
 # Main execution
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Generate an SVG memory map from a file.")
-    parser.add_argument("input_file", help="Path to the input file containing memory mapping data.")
-    parser.add_argument("output_file", help="Path to the output SVG file.")
+    parser.add_argument("input_file", nargs="?", help="Path to the input file containing memory mapping data.")
+    parser.add_argument("output_file", nargs="?", help="Path to the output SVG file.")
+    parser.add_argument("-w", "--watch", nargs="+", metavar="MAP", help="Watch growing map files (globs allowed, e.g. '/tmp/perf-*.map') and keep perf-<pid>.svg and region-occupancy.perf-<pid>.csv up to date")
+    parser.add_argument("-o", "--output-dir", default=".", help="Output folder in watch mode (default: current folder)")
+    parser.add_argument("-i", "--interval", type=float, default=WATCH_INTERVAL, help=f"Seconds between polls in watch mode (default: {WATCH_INTERVAL})")
+    parser.add_argument("--duration", type=float, help="Stop watching after this many seconds (default: until interrupted)")
     args = parser.parse_args()
 
-    # Parse the input file
-    functions = parse_input_file(args.input_file)
+    if args.watch:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+        try:
+            asyncio.run(watch(args.watch, args.output_dir, args.interval, args.duration))
+        except KeyboardInterrupt:
+            pass
+    else:
+        if not args.input_file or not args.output_file:
+            parser.error("input_file and output_file are required without --watch")
+
+        # Parse the input file
+        functions = parse_input_file(args.input_file)
 
-    # Draw the SVG
-    draw_svg(functions, args.output_file)
+        # Draw the SVG
+        draw_svg(functions, args.output_file)
 
 
 
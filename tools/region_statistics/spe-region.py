@@ -4,6 +4,7 @@ import os
 import shutil
 import sys
 import re
+import socket
 import subprocess
 import argparse
 import logging
@@ -12,6 +13,19 @@ import csv
 import seaborn as sns
 import numpy as np
 
+from stage_profiler import StageProfiler
+from spe_reader import SpeCsvReader, HEX, DEC, format_hex_lines, iter_hex_values, read_header, missing_columns
+from dedup import sort_and_deduplicate_file, approximate_hot_addresses
+from kallsyms import KernelSymbols, kernel_attribution, KALLSYMS_FILE, MODULES_FILE
+from topology import CpuTopology, CpuLineCounter, node_breakdown
+from data_heat import DataHeat, DATA_COLUMNS, DATA_FLAGS, LATENCY_BUCKETS, latency_label
+from aggregate import GroupSums, regroup
+from fleet import summarize_space, write_summary
+
+# The address list format is shared with the mitigation scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "slc_mitigation", "scripts"))
+from addrlist import AddressList, write_address_list
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -24,12 +38,26 @@ def file_exists(file_path):
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Process perf data using spe-parser.")
 parser.add_argument("perf_data_file", help="Path to the perf.data file")
+parser.add_argument("--skip-parser", action="store_true", help="Reuse existing spe-<perf_data_file>-*.csv files instead of running spe-parser")
+parser.add_argument("--trace", action="store_true", help="Also save the stages as a Chrome trace (spe-region-trace.<perf_data_file>.json)")
+parser.add_argument("--dedup-memory", type=int, default=1024, help="Memory budget in MB for sorting and deduplicating addresses, spills to disk above it (default: 1024)")
+parser.add_argument("--approx-top", type=int, help="Approximate dedup for very large captures: only keep the N hottest addresses and estimate the unique count")
+parser.add_argument("--kallsyms", help=f"kallsyms file or snapshot (.npz from kallsyms.py) for kernel symbols (default: {KALLSYMS_FILE})")
+parser.add_argument("--modules", default=MODULES_FILE, help=f"modules file used with a kallsyms file (default: {MODULES_FILE})")
+parser.add_argument("--topology", help="CPU topology file (cpu,node,cluster CSV from topology.py) of the capture host (default: this host's sysfs)")
+parser.add_argument("--pid", type=int, default=0, help="Profiled pid, the user space address list is only accepted by mitigate-user.py for it (default: 0, any)")
+parser.add_argument("--host", default=socket.gethostname(), help="Host name recorded in the run summary (spe-region-summary.<perf_data_file>.json) for fleet.py (default: this host)")
+parser.add_argument("--cprofile", action="store_true", help="Also save cProfile stats (spe-region.<perf_data_file>.prof)")
 args = parser.parse_args()
 
 filename = args.perf_data_file
 
 # Validate input file
-file_exists(filename)
+if not args.skip_parser:
+    file_exists(filename)
+
+# Time every stage, the run report is saved in the output folder
+profiler = StageProfiler(enable_cprofile=args.cprofile)
 
 
 # Remove existing files 
@@ -45,6 +73,8 @@ files_to_remove = [
     f"ins-kernel-cacheline.{filename}.csv",
     f"ins-cacheline-uniq.{filename}.csv",
     f"ins-cacheline-uniq-kernel.{filename}.csv",
+    f"ins-cacheline-uniq.{filename}.addr",
+    f"ins-cacheline-uniq-kernel.{filename}.addr",
     f"ins-2mb-range-counts.{filename}.csv",
     f"ins-kernel-2mb-range-counts.{filename}.csv",
     f"ins-1k-touch-ratio.{filename}.csv",
@@ -61,77 +91,206 @@ files_to_remove = [
     f"br-kernel.{filename}.csv",
     f"br.{filename}.png",
     f"br-kernel.{filename}.png",
+    f"kernel-symbols.{filename}.csv",
+    f"kernel-modules.{filename}.csv",
+    f"kernel-cross-module-br.{filename}.csv",
+    f"kernel-summary.{filename}.txt",
+    f"ins-node-2mb-breakdown.{filename}.csv",
+    f"ins-kernel-node-2mb-breakdown.{filename}.csv",
+    f"ins-cpu-counts.{filename}.csv",
+    f"ins-kernel-cpu-counts.{filename}.csv",
+    f"ins-shared-cacheline.{filename}.csv",
+    f"ins-shared-cacheline-kernel.{filename}.csv",
+    f"data-2mb-heat.{filename}.csv",
+    f"data-page-heat.{filename}.csv",
+    f"data-latency-histogram.{filename}.csv",
+    f"data-code-regions.{filename}.csv",
+    f"data-miss-pcs.{filename}.csv",
+    f"data-summary.{filename}.txt",
+    f"spe-region-report.{filename}.json",
+    f"spe-region-summary.{filename}.json",
+    f"spe-region-trace.{filename}.json",
+    f"spe-region.{filename}.prof",
 ]
 
+# Reused spe-parser CSVs are inputs, check them before removing the old outputs and leave them in place
+if args.skip_parser:
+    for kind in ("ldst", "br", "other"):
+        file_exists(f"spe-{filename}-{kind}.csv")
+        files_to_remove.remove(f"spe-{filename}-{kind}.csv")
+
 if os.path.exists(f"{filename}-output"):
     shutil.rmtree(f"{filename}-output")
     logging.info(f"Removed folder: {filename}-output")
 
 
 # Run spe-parser
-try:
-    logging.info(f"Running spe-parser on {filename}")
-    subprocess.run(["spe-parser", "-s", "-t", "csv", "-p", f"spe-{filename}", filename], check=True)
-except subprocess.CalledProcessError as e:
-    logging.error(f"Error running spe-parser: {e}")
-    sys.exit(1)
-
-# Process CSV files to extract instructions
-def process_csv_pc(input_file, output_file, exception_level):
-    unique_lines = set()  # Use a set to store unique lines
+if args.skip_parser:
+    logging.info(f"Skipped spe-parser, reusing spe-{filename}-*.csv")
+else:
+    with profiler.stage("spe-parser"):
+        try:
+            logging.info(f"Running spe-parser on {filename}")
+            subprocess.run(["spe-parser", "-s", "-t", "csv", "-p", f"spe-{filename}", filename], check=True)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error running spe-parser: {e}")
+            sys.exit(1)
+
+# Process CSV files to extract user-space (el 0) and kernel-space (el 2) instructions in one pass,
+# counting samples per (cpu, cacheline) and per kernel PC and, for ldst records, the data side on the way
+def process_csv_pc(input_file, output_file, kernel_output_file, counter, kernel_counter, kernel_pcs, data_heat=None):
     try:
-        with open(output_file, "a") as outfile:
-            with open(input_file, "r") as infile:
-                for line in infile:
-                    if line.split(",")[3] == exception_level:
-                        outfile.write(line.split(",")[2].strip() + "\n") 
-        logging.info(f"Processed {input_file} -> {output_file}")
+        columns, flags = {"pc": HEX, "el": DEC, "cpu": DEC}, {}
+        if data_heat is not None:
+            columns.update(DATA_COLUMNS)
+            flags.update(DATA_FLAGS)
+        reader = SpeCsvReader(input_file, columns, flags)
+        with open(output_file, "ab") as outfile, open(kernel_output_file, "ab") as kernel_outfile:
+            for chunk in reader:
+                user, kernel = chunk["el"] == 0, chunk["el"] == 2
+                outfile.write(format_hex_lines(chunk["pc"][user]))
+                kernel_outfile.write(format_hex_lines(chunk["pc"][kernel]))
+                counter.add(chunk["cpu"][user], chunk["pc"][user])
+                kernel_counter.add(chunk["cpu"][kernel], chunk["pc"][kernel])
+                kernel_pcs.add([chunk["pc"][kernel]])
+                if data_heat is not None:
+                    data_heat.add(chunk)
+        logging.info(f"Processed {input_file} -> {output_file}, {kernel_output_file}")
+        return reader.rows
     except Exception as e:
         logging.error(f"Error processing {input_file}: {e}")
 
-# Process user-space instructions
-process_csv_pc(f"spe-{filename}-ldst.csv", f"ins.{filename}.csv", "0")
-process_csv_pc(f"spe-{filename}-br.csv", f"ins.{filename}.csv", "0")
-process_csv_pc(f"spe-{filename}-other.csv", f"ins.{filename}.csv", "0")
+# Process user-space and kernel-space instructions
+cpu_lines_user = CpuLineCounter()
+cpu_lines_kernel = CpuLineCounter()
+kernel_pcs = GroupSums()  # exact PCs for kernel symbols, they are not cacheline aligned
+# The data side is optional, without its columns the ldst PCs are still extracted
+def create_data_heat(input_file):
+    try:
+        missing = missing_columns(read_header(input_file), DATA_COLUMNS, DATA_FLAGS)
+    except OSError:
+        return None
+    if missing:
+        logging.warning(f"{input_file} is missing columns {', '.join(missing)}, skipping the data heat")
+        return None
+    return DataHeat()
 
-# Process kernel-space instructions
-process_csv_pc(f"spe-{filename}-ldst.csv", f"ins-kernel.{filename}.csv", "2")
-process_csv_pc(f"spe-{filename}-br.csv", f"ins-kernel.{filename}.csv", "2")
-process_csv_pc(f"spe-{filename}-other.csv", f"ins-kernel.{filename}.csv", "2")
+data_heat = create_data_heat(f"spe-{filename}-ldst.csv")
+with profiler.stage("extract-pc") as stage:
+    for kind in ("ldst", "br", "other"):
+        stage.add_rows(process_csv_pc(f"spe-{filename}-{kind}.csv", f"ins.{filename}.csv", f"ins-kernel.{filename}.csv",
+                                      cpu_lines_user, cpu_lines_kernel, kernel_pcs, data_heat if kind == "ldst" else None))
 
-# Deduplicate PCs
+# Deduplicate PCs, addresses are sorted numerically
 def sort_and_deduplicate(input_file, output_file):
     try:
-        with open(input_file, "r") as infile:
-            lines = sorted(set(infile.readlines()))
-        with open(output_file, "w") as outfile:
-            outfile.writelines(lines)
+        if args.approx_top:
+            count, estimate = approximate_hot_addresses(input_file, output_file, args.approx_top)
+            logging.info(f"Kept {count} hottest of ~{estimate} unique addresses {input_file} -> {output_file}")
+            return count
+        count = sort_and_deduplicate_file(input_file, output_file, args.dedup_memory * 1024 * 1024)
         logging.info(f"Sorted and deduplicated {input_file} -> {output_file}")
+        return count
     except Exception as e:
         logging.error(f"Error sorting and deduplicating {input_file}: {e}")
 
 # Sort and deduplicate PCs
-sort_and_deduplicate(f"ins.{filename}.csv", f"ins-uniq.{filename}.csv")
-sort_and_deduplicate(f"ins-kernel.{filename}.csv", f"ins-uniq-kernel.{filename}.csv")
+with profiler.stage("dedup-pc") as stage:
+    stage.add_rows(sort_and_deduplicate(f"ins.{filename}.csv", f"ins-uniq.{filename}.csv"))
+    stage.add_rows(sort_and_deduplicate(f"ins-kernel.{filename}.csv", f"ins-uniq-kernel.{filename}.csv"))
 
 # Convert addresses to cacheline granularity
 def convert_to_cacheline(input_file, output_file):
+    rows = 0
     try:
         with open(input_file, "r") as infile, open(output_file, "w") as outfile:
             for line in infile:
                 address = int(line.strip(), 16)
                 cacheline_address = (address >> 6) << 6
                 outfile.write(f"{cacheline_address:x}\n")
+                rows += 1
         logging.info(f"Converted {input_file} -> {output_file}")
+        return rows
     except Exception as e:
         logging.error(f"Error converting {input_file}: {e}")
 
-convert_to_cacheline(f"ins-uniq.{filename}.csv", f"ins-cacheline.{filename}.csv")
-convert_to_cacheline(f"ins-uniq-kernel.{filename}.csv", f"ins-kernel-cacheline.{filename}.csv")
+with profiler.stage("convert-cacheline") as stage:
+    stage.add_rows(convert_to_cacheline(f"ins-uniq.{filename}.csv", f"ins-cacheline.{filename}.csv"))
+    stage.add_rows(convert_to_cacheline(f"ins-uniq-kernel.{filename}.csv", f"ins-kernel-cacheline.{filename}.csv"))
+
+# With --approx-top, keep the hottest cachelines by their real sample counts
+def hottest_cachelines(counter, output_file, top):
+    """
+    The cacheline file of the approximated PCs only holds the unique hottest
+    PCs, so counting it again would rank lines by PCs instead of samples.
+
+    Args:
+        counter (CpuLineCounter): Sample counts per (cpu, cacheline) from process_csv_pc.
+        output_file (str): Output file, the hottest cacheline addresses sorted numerically.
+        top (int): Number of cachelines to keep.
+
+    Returns:
+        int: Number of cachelines written.
+    """
+    try:
+        _, lines, counts = counter.result()
+        line_ids, line_counts, _ = regroup(lines, counts.reshape(-1, 1))
+        if len(line_ids) > top:
+            line_ids = np.sort(line_ids[np.argpartition(-line_counts[:, 0], top)[:top]])
+        with open(output_file, "wb") as outfile:
+            outfile.write(format_hex_lines(line_ids.astype(np.uint64) << np.uint64(6), ""))
+        logging.info(f"Kept {len(line_ids)} hottest cachelines -> {output_file}")
+        return len(line_ids)
+    except Exception as e:
+        logging.error(f"Error saving hottest cachelines {output_file}: {e}")
 
 # Sort and deduplicate cacheline files
-sort_and_deduplicate(f"ins-cacheline.{filename}.csv", f"ins-cacheline-uniq.{filename}.csv")
-sort_and_deduplicate(f"ins-kernel-cacheline.{filename}.csv", f"ins-cacheline-uniq-kernel.{filename}.csv")
+with profiler.stage("dedup-cacheline") as stage:
+    if args.approx_top:
+        stage.add_rows(hottest_cachelines(cpu_lines_user, f"ins-cacheline-uniq.{filename}.csv", args.approx_top))
+        stage.add_rows(hottest_cachelines(cpu_lines_kernel, f"ins-cacheline-uniq-kernel.{filename}.csv", args.approx_top))
+    else:
+        stage.add_rows(sort_and_deduplicate(f"ins-cacheline.{filename}.csv", f"ins-cacheline-uniq.{filename}.csv"))
+        stage.add_rows(sort_and_deduplicate(f"ins-kernel-cacheline.{filename}.csv", f"ins-cacheline-uniq-kernel.{filename}.csv"))
+
+# The capture time is the perf.data (or spe-parser output) time
+def capture_time():
+    capture_file = filename if os.path.exists(filename) else f"spe-{filename}-ldst.csv"
+    return os.path.getmtime(capture_file)
+
+# Save the cachelines as a binary address list for mitigate-user.py/mitigate-kernel.py, weighted by samples
+def write_mitigation_list(input_file, counter, output_file, kernel):
+    """
+    Args:
+        input_file (str): Path to the file with unique cacheline addresses.
+        counter (CpuLineCounter): Sample counts per (cpu, cacheline) from process_csv_pc.
+        output_file (str): Output address list (.addr).
+        kernel (bool): Kernel cachelines.
+
+    Returns:
+        int: Number of addresses written.
+    """
+    try:
+        addresses = np.concatenate([np.empty(0, dtype=np.uint64)] + list(iter_hex_values(input_file)))
+        _, lines, counts = counter.result()
+        line_ids, line_counts, _ = regroup(lines, counts.reshape(-1, 1))
+        keys = (addresses >> np.uint64(6)).astype(np.int64)
+        weights = np.zeros(len(addresses), dtype=np.int64)
+        if len(line_ids):
+            index = np.minimum(np.searchsorted(line_ids, keys), len(line_ids) - 1)
+            found = line_ids[index] == keys
+            weights[found] = line_counts[index[found], 0]
+        address_list = AddressList.from_addresses(addresses, weights, pid=0 if kernel else args.pid, granularity=64,
+                                                  timestamp=capture_time(), kernel=kernel)
+        size = write_address_list(output_file, address_list)
+        logging.info(f"Saved {len(address_list)} addresses in {size} bytes -> {output_file}")
+        return len(address_list)
+    except Exception as e:
+        logging.error(f"Error saving address list {output_file}: {e}")
+
+with profiler.stage("address-lists") as stage:
+    stage.add_rows(write_mitigation_list(f"ins-cacheline-uniq.{filename}.csv", cpu_lines_user, f"ins-cacheline-uniq.{filename}.addr", False))
+    stage.add_rows(write_mitigation_list(f"ins-cacheline-uniq-kernel.{filename}.csv", cpu_lines_kernel, f"ins-cacheline-uniq-kernel.{filename}.addr", True))
 
 # Calculate 2MB range hit counts
 def calculate_2mb_range_counts(input_file, output_file):
@@ -143,9 +302,11 @@ def calculate_2mb_range_counts(input_file, output_file):
         output_file (str): Path to the output file to save the results.
     """
     range_counts = {}
+    rows = 0
     try:
         with open(input_file, "r") as infile:
             for line in infile:
+                rows += 1
                 address = int(line.strip(), 16)
                 range_start = (address // (2 * 1024 * 1024)) * (2 * 1024 * 1024)
                 range_key = f"0x{range_start:x}"
@@ -158,11 +319,13 @@ def calculate_2mb_range_counts(input_file, output_file):
             for range_start, count in sorted(range_counts.items()):
                 outfile.write(f"{range_start}: {count}\n")
         logging.info(f"Processed {input_file} -> {output_file}")
+        return rows
     except Exception as e:
         logging.error(f"Error processing {input_file}: {e}")
 
-calculate_2mb_range_counts(f"ins.{filename}.csv", f"ins-2mb-range-counts.{filename}.csv")
-calculate_2mb_range_counts(f"ins-kernel.{filename}.csv", f"ins-kernel-2mb-range-counts.{filename}.csv")
+with profiler.stage("2mb-range-counts") as stage:
+    stage.add_rows(calculate_2mb_range_counts(f"ins.{filename}.csv", f"ins-2mb-range-counts.{filename}.csv"))
+    stage.add_rows(calculate_2mb_range_counts(f"ins-kernel.{filename}.csv", f"ins-kernel-2mb-range-counts.{filename}.csv"))
 
 # Calculate address space touch ratio in 1K granularity for each 2MB range
 def calculate_1k_touch_ratio(input_2mb_file, input_pc_file, output_file):
@@ -175,6 +338,7 @@ def calculate_1k_touch_ratio(input_2mb_file, input_pc_file, output_file):
         output_file (str): Path to the output file to save the results.
     """
     touched_1k_spaces = {}
+    rows = 0
     try:
         with open(input_2mb_file, "r") as infile:
             for line in infile:
@@ -184,6 +348,7 @@ def calculate_1k_touch_ratio(input_2mb_file, input_pc_file, output_file):
 
         with open(input_pc_file, "r") as pc_file:
             for line in pc_file:
+                rows += 1
                 pc_address = int(line.strip(), 16)
                 range_start = (pc_address // (2 * 1024 * 1024)) * (2 * 1024 * 1024)
                 if range_start in touched_1k_spaces:
@@ -198,20 +363,22 @@ def calculate_1k_touch_ratio(input_2mb_file, input_pc_file, output_file):
                 outfile.write(f"0x{range_start:x}: {ratio:.4f}\n")
 
         logging.info(f"Processed {input_pc_file} -> {output_file}")
+        return rows
 
     except Exception as e:
         logging.error(f"Error calculating 1K touch ratio for {input_pc_file}: {e}")
 
-calculate_1k_touch_ratio(
-    f"ins-2mb-range-counts.{filename}.csv", 
-    f"ins.{filename}.csv", 
-    f"ins-1k-touch-ratio.{filename}.csv"
-)
-calculate_1k_touch_ratio(
-    f"ins-kernel-2mb-range-counts.{filename}.csv", 
-    f"ins-kernel.{filename}.csv", 
-    f"ins-kernel-1k-touch-ratio.{filename}.csv"
-)
+with profiler.stage("1k-touch-ratio") as stage:
+    stage.add_rows(calculate_1k_touch_ratio(
+        f"ins-2mb-range-counts.{filename}.csv", 
+        f"ins.{filename}.csv", 
+        f"ins-1k-touch-ratio.{filename}.csv"
+    ))
+    stage.add_rows(calculate_1k_touch_ratio(
+        f"ins-kernel-2mb-range-counts.{filename}.csv", 
+        f"ins-kernel.{filename}.csv", 
+        f"ins-kernel-1k-touch-ratio.{filename}.csv"
+    ))
 
 # Calculate address space touch ratio in cache line granularity for each 2MB range
 def calculate_cacheline_touch_ratio(input_2mb_file, input_cacheline_file, output_file):
@@ -224,6 +391,7 @@ def calculate_cacheline_touch_ratio(input_2mb_file, input_cacheline_file, output
         output_file (str): Path to the output file to save the results.
     """
     touched_cachelines = {}
+    rows = 0
     try:
         with open(input_2mb_file, "r") as infile:
             for line in infile:
@@ -233,6 +401,7 @@ def calculate_cacheline_touch_ratio(input_2mb_file, input_cacheline_file, output
 
         with open(input_cacheline_file, "r") as cacheline_file:
             for line in cacheline_file:
+                rows += 1
                 cacheline_address = int(line.strip(), 16)
                 range_start = (cacheline_address // (2 * 1024 * 1024)) * (2 * 1024 * 1024)
                 if range_start in touched_cachelines:
@@ -246,20 +415,22 @@ def calculate_cacheline_touch_ratio(input_2mb_file, input_cacheline_file, output
                 outfile.write(f"0x{range_start:x}: {ratio:.4f}\n")
 
         logging.info(f"Processed {input_cacheline_file} -> {output_file}")
+        return rows
 
     except Exception as e:
         logging.error(f"Error calculating cacheline touch ratio for {input_cacheline_file}: {e}")
 
-calculate_cacheline_touch_ratio(
-    f"ins-2mb-range-counts.{filename}.csv", 
-    f"ins-cacheline-uniq.{filename}.csv", 
-    f"ins-cacheline-touch-ratio.{filename}.csv"
-)
-calculate_cacheline_touch_ratio(
-    f"ins-kernel-2mb-range-counts.{filename}.csv", 
-    f"ins-cacheline-uniq-kernel.{filename}.csv", 
-    f"ins-kernel-cacheline-touch-ratio.{filename}.csv"
-)
+with profiler.stage("cacheline-touch-ratio") as stage:
+    stage.add_rows(calculate_cacheline_touch_ratio(
+        f"ins-2mb-range-counts.{filename}.csv", 
+        f"ins-cacheline-uniq.{filename}.csv", 
+        f"ins-cacheline-touch-ratio.{filename}.csv"
+    ))
+    stage.add_rows(calculate_cacheline_touch_ratio(
+        f"ins-kernel-2mb-range-counts.{filename}.csv", 
+        f"ins-cacheline-uniq-kernel.{filename}.csv", 
+        f"ins-kernel-cacheline-touch-ratio.{filename}.csv"
+    ))
 
 # Plot hitogram for 2MB range count files
 def plot_occurrence_count_hitogram(input_file, title, output_image):
@@ -337,16 +508,17 @@ def plot_occurrence_count_hitogram(input_file, title, output_image):
     except Exception as e:
         logging.error(f"Error plotting hitogram for {input_file}: {e}")
         
-plot_occurrence_count_hitogram(
-    f"ins-2mb-range-counts.{filename}.csv", 
-    "User-Space 2MB Range Occurrence Counts", 
-    f"ins-2mb-range-histogram.{filename}.png"
-)
-plot_occurrence_count_hitogram(
-    f"ins-kernel-2mb-range-counts.{filename}.csv", 
-    "Kernel-Space 2MB Range Occurrence Counts", 
-    f"ins-kernel-2mb-range-histogram.{filename}.png"
-)
+with profiler.stage("plot-2mb-range-counts"):
+    plot_occurrence_count_hitogram(
+        f"ins-2mb-range-counts.{filename}.csv", 
+        "User-Space 2MB Range Occurrence Counts", 
+        f"ins-2mb-range-histogram.{filename}.png"
+    )
+    plot_occurrence_count_hitogram(
+        f"ins-kernel-2mb-range-counts.{filename}.csv", 
+        "Kernel-Space 2MB Range Occurrence Counts", 
+        f"ins-kernel-2mb-range-histogram.{filename}.png"
+    )
 
 # Plot histograms touch ratios
 def plot_touch_ratio_histogram(input_file, title, output_image):
@@ -424,54 +596,79 @@ def plot_touch_ratio_histogram(input_file, title, output_image):
     except Exception as e:
         logging.error(f"Error plotting histogram for {input_file}: {e}")
 
-# Plot histograms for 1K granularity touch ratios
-plot_touch_ratio_histogram(
-    f"ins-1k-touch-ratio.{filename}.csv", 
-    "User-Space 1K Granularity Touch Ratios for 2MB Ranges", 
-    f"ins-1k-touch-ratio-histogram.{filename}.png"
-)
-plot_touch_ratio_histogram(
-    f"ins-kernel-1k-touch-ratio.{filename}.csv", 
-    "Kernel-Space 1K Granularity Touch Ratios for 2MB Ranges", 
-    f"ins-kernel-1k-touch-ratio-histogram.{filename}.png"
-)
-
-# Plot histograms for cacheline granularity touch ratios
-plot_touch_ratio_histogram(
-    f"ins-cacheline-touch-ratio.{filename}.csv", 
-    "User-Space Cacheline Granularity Touch Ratios for 2MB Ranges", 
-    f"ins-cacheline-touch-ratio-histogram.{filename}.png"
-)
-plot_touch_ratio_histogram(
-    f"ins-kernel-cacheline-touch-ratio.{filename}.csv", 
-    "Kernel-Space Cacheline Granularity Touch Ratios for 2MB Ranges", 
-    f"ins-kernel-cacheline-touch-ratio-histogram.{filename}.png"
-) 
-
-# Read the br.csv file and process the data
-def process_br_csv(input_file, output_file, el=None):
+with profiler.stage("plot-touch-ratios"):
+    # Plot histograms for 1K granularity touch ratios
+    plot_touch_ratio_histogram(
+        f"ins-1k-touch-ratio.{filename}.csv", 
+        "User-Space 1K Granularity Touch Ratios for 2MB Ranges", 
+        f"ins-1k-touch-ratio-histogram.{filename}.png"
+    )
+    plot_touch_ratio_histogram(
+        f"ins-kernel-1k-touch-ratio.{filename}.csv", 
+        "Kernel-Space 1K Granularity Touch Ratios for 2MB Ranges", 
+        f"ins-kernel-1k-touch-ratio-histogram.{filename}.png"
+    )
+
+    # Plot histograms for cacheline granularity touch ratios
+    plot_touch_ratio_histogram(
+        f"ins-cacheline-touch-ratio.{filename}.csv", 
+        "User-Space Cacheline Granularity Touch Ratios for 2MB Ranges", 
+        f"ins-cacheline-touch-ratio-histogram.{filename}.png"
+    )
+    plot_touch_ratio_histogram(
+        f"ins-kernel-cacheline-touch-ratio.{filename}.csv", 
+        "Kernel-Space Cacheline Granularity Touch Ratios for 2MB Ranges", 
+        f"ins-kernel-cacheline-touch-ratio-histogram.{filename}.png"
+    ) 
+
+# Read the br.csv file once, aggregating the taken branches chunk by chunk
+def read_br_taken(input_file):
+    """
+    Only unique keys are kept, so memory grows with the number of region
+    pairs and kernel branch sites, not with the number of samples.
+
+    Args:
+        input_file (str): Path to the spe-parser br CSV file.
+
+    Returns:
+        tuple: ((el, pc_region, br_tgt_region) keys and counts, (pc, br_tgt) keys and counts of
+               the taken kernel branches) and the number of rows read.
+    """
+    region_mask = ~np.uint64(2 * 1024 * 1024 - 1)
+    region_pairs = GroupSums(num_keys=3)
+    kernel_pairs = GroupSums(num_keys=2)
+    try:
+        reader = SpeCsvReader(input_file, {"pc": HEX, "br_tgt": HEX, "el": DEC}, {"not_taken": ("event", "NOT-TAKEN")})
+        for chunk in reader:
+            # Filter out lines containing "NOT-TAKEN"
+            taken = ~chunk["not_taken"]
+            pc, br_tgt, el = chunk["pc"][taken], chunk["br_tgt"][taken], chunk["el"][taken]
+            # Convert addresses to 2MB regions
+            region_pairs.add([el, pc & region_mask, br_tgt & region_mask])
+            # Kernel symbols and modules are not 2MB aligned, keep the exact kernel branches
+            kernel = el == 2
+            kernel_pairs.add([pc[kernel], br_tgt[kernel]])
+        logging.info(f"Read {reader.rows} branch records from {input_file}")
+        return (region_pairs.result(), kernel_pairs.result()), reader.rows
+    except Exception as e:
+        logging.error(f"Error reading {input_file}: {e}")
+        return None, 0
+
+# Count jumps between 2MB regions and save them
+def process_br_csv(br_taken, output_file, el=None):
     pc_br_tgt_counts = {}  # Dictionary to store counts of jumps between 2MB regions
 
     try:
-        with open(input_file, "r") as infile:
-            reader = csv.DictReader(infile)
-            for row in reader:
-                # Filter out lines containing "NOT-TAKEN"
-                if "NOT-TAKEN" not in row["event"]:
-                    if el is None or row["el"] == el:
-                            pc = row["pc"]
-                            br_tgt = row["br_tgt"]
-
-                            # Convert addresses to 2MB regions
-                            pc_region = (int(pc, 16) // (2 * 1024 * 1024)) * (2 * 1024 * 1024)
-                            br_tgt_region = (int(br_tgt, 16) // (2 * 1024 * 1024)) * (2 * 1024 * 1024)
-
-                            # Update the count for this (pc_region, br_tgt_region) pair
-                            key = (pc_region, br_tgt_region)
-                            if key in pc_br_tgt_counts:
-                                pc_br_tgt_counts[key] += 1
-                            else:
-                                pc_br_tgt_counts[key] = 1
+        (keys, sums), _ = br_taken
+        if el is not None:
+            keep = keys[:, 0] == int(el)
+            keys, sums = keys[keep], sums[keep]
+
+        # Count each (pc_region, br_tgt_region) pair, addresses are stored as int64
+        if len(keys):
+            pairs, counts, _ = regroup(keys[:, 1:], sums[:, :1])
+            pairs = pairs.astype(np.uint64)
+            pc_br_tgt_counts = {(int(a), int(b)): int(c) for (a, b), c in zip(pairs.tolist(), counts[:, 0].tolist())}
 
         # Sort the data by pc_2mb_region
         sorted_counts = sorted(pc_br_tgt_counts.items(), key=lambda x: x[0][0])  # Sort by pc_region
@@ -483,13 +680,13 @@ def process_br_csv(input_file, output_file, el=None):
             for (pc_region, br_tgt_region), count in sorted_counts:
                 writer.writerow([f"0x{pc_region:x}", f"0x{br_tgt_region:x}", count])
 
-        logging.info(f"Processed {input_file} -> {output_file}")
+        logging.info(f"Processed branch regions -> {output_file}")
 
         # Return the counts for heatmap generation
         return pc_br_tgt_counts
 
     except Exception as e:
-        logging.error(f"Error processing {input_file}: {e}")
+        logging.error(f"Error processing branch regions for {output_file}: {e}")
         return None
 
 
@@ -552,11 +749,234 @@ def plot_heatmap(pc_br_tgt_counts, output_image):
         logging.error(f"Error drawing heatmap: {e}")
 
 
-pc_br_tgt_counts_user = process_br_csv(f"spe-{filename}-br.csv", f"br.{filename}.csv", "0")
-plot_heatmap(pc_br_tgt_counts_user, f"br.{filename}.png")
+with profiler.stage("branch-regions") as stage:
+    br_taken, rows = read_br_taken(f"spe-{filename}-br.csv")
+    stage.add_rows(rows)
+    pc_br_tgt_counts_user = process_br_csv(br_taken, f"br.{filename}.csv", "0")
+    pc_br_tgt_counts_kernel = process_br_csv(br_taken, f"br-kernel.{filename}.csv", "2")
+
+# Attribute kernel samples to symbols and modules
+def process_kernel_symbols(kernel_pcs, br_taken, output_prefix):
+    """
+    Write per-symbol and per-module heat and touch ratio, and branch counts
+    between modules, to help decide if kernel mitigation is worth its flush cost.
+
+    Args:
+        kernel_pcs (GroupSums): Samples per kernel PC from process_csv_pc.
+        br_taken (tuple): Aggregated taken branches from read_br_taken.
+        output_prefix (str): Output files are <prefix>-symbols/-modules/-cross-module-br.<file>.csv.
+
+    Returns:
+        int: Number of kernel samples attributed.
+    """
+    try:
+        if args.kallsyms and args.kallsyms.endswith(".npz"):
+            symbols = KernelSymbols.from_snapshot(args.kallsyms)
+        else:
+            symbols = KernelSymbols.from_proc(args.kallsyms or KALLSYMS_FILE, args.modules)
+            if not args.kallsyms:
+                logging.warning("Using the live /proc/kallsyms, it only matches captures taken on this boot")
+
+        pcs, counts = kernel_pcs.result()
+        _, (branches, branch_counts) = br_taken
+        branches = branches.astype(np.uint64)
+        result = kernel_attribution(symbols, pcs[:, 0].astype(np.uint64), counts[:, 0], branches[:, 0], branches[:, 1], branch_counts[:, 0])
+
+        with open(f"{output_prefix}-symbols.{filename}.csv", "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["symbol", "module", "address", "size", "samples", "cacheline_touch_ratio"])
+            for name, module, address, size, samples, ratio in result["symbols"]:
+                writer.writerow([name, module, f"0x{address:x}", size, samples, f"{ratio:.4f}"])
+
+        with open(f"{output_prefix}-modules.{filename}.csv", "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["module", "samples", "touched_cachelines", "cacheline_touch_ratio"])
+            for module, samples, lines, ratio in result["modules"]:
+                writer.writerow([module, samples, lines, f"{ratio:.4f}"])
 
-pc_br_tgt_counts_kernel = process_br_csv(f"spe-{filename}-br.csv", f"br-kernel.{filename}.csv", "2")
-plot_heatmap(pc_br_tgt_counts_kernel, f"br-kernel.{filename}.png")
+        with open(f"{output_prefix}-cross-module-br.{filename}.csv", "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["src_module", "dst_module", "count"])
+            writer.writerows(result["cross_module"])
+
+        summary = result["summary"]
+        with open(f"{output_prefix}-summary.{filename}.txt", "w") as outfile:
+            for key, value in summary.items():
+                outfile.write(f"{key}: {value}\n")
+
+        logging.info(f"Kernel samples: {summary['resolved_samples']}/{summary['samples']} resolved, "
+                     f"{summary['hot_symbols']} symbols in {summary['hot_modules']} modules, "
+                     f"{summary['unique_cachelines']} cachelines to flush per round")
+        return summary["samples"]
+
+    except Exception as e:
+        logging.error(f"Error attributing kernel samples: {e}")
+
+with profiler.stage("kernel-symbols") as stage:
+    if br_taken is not None:
+        stage.add_rows(process_kernel_symbols(kernel_pcs, br_taken, "kernel"))
+
+# Load the CPU -> NUMA node map of the capture host
+def load_topology():
+    try:
+        if args.topology:
+            return CpuTopology.from_file(args.topology)
+        logging.warning("Using this host's CPU topology, it only matches captures taken on this host")
+        return CpuTopology.from_sysfs()
+    except (OSError, ValueError) as e:
+        logging.warning(f"No CPU topology ({e}), counting all CPUs as node 0")
+        return None
+
+# Per-node and per-CPU breakdown, and the cachelines touched from more than one node
+def process_numa_breakdown(counter, topology, region_file, cpu_file, shared_file):
+    """
+    Lines sampled from several nodes bounce between the nodes' caches over
+    the CMN, they are the ones worth flushing first.
+
+    Args:
+        counter (CpuLineCounter): Sample counts per (cpu, cacheline).
+        topology (CpuTopology): CPU to node map, None for a single node.
+        region_file (str): Output samples and cacheline touch ratio per node and 2MB region.
+        cpu_file (str): Output samples per CPU.
+        shared_file (str): Output shared cacheline addresses, one per line, hottest first.
+
+    Returns:
+        int: Number of shared cachelines.
+    """
+    try:
+        if topology is None:
+            cpus = np.unique(counter.result()[0])
+            topology = CpuTopology(cpus, np.zeros(len(cpus), dtype=np.int64), np.zeros(len(cpus), dtype=np.int64))
+        result = node_breakdown(counter, topology)
+        unknown = [cpu for cpu, node, _, _ in result["cpus"] if node < 0]
+        if unknown:
+            logging.warning(f"{len(unknown)} sampled CPUs are not in the topology, counted as node -1 "
+                            "and left out of the shared cachelines")
+
+        with open(region_file, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["node", "2mb_region", "samples", "cacheline_touch_ratio"])
+            for node, region, samples, ratio in result["regions"]:
+                writer.writerow([node, f"0x{region:x}", samples, f"{ratio:.4f}"])
+
+        with open(cpu_file, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["cpu", "node", "cluster", "samples"])
+            writer.writerows(result["cpus"])
+
+        shared = sorted(result["shared"], key=lambda row: -row[2])
+        with open(shared_file, "w") as outfile:
+            for address, _, _ in shared:
+                outfile.write(f"0x{address:x}\n")
+
+        logging.info(f"Processed NUMA breakdown -> {region_file}, {cpu_file}, {shared_file} "
+                     f"({len(shared)} cachelines shared between nodes)")
+        return len(shared)
+
+    except Exception as e:
+        logging.error(f"Error processing NUMA breakdown for {region_file}: {e}")
+
+with profiler.stage("numa-breakdown") as stage:
+    topology = load_topology()
+    stage.add_rows(process_numa_breakdown(cpu_lines_user, topology, f"ins-node-2mb-breakdown.{filename}.csv",
+                                          f"ins-cpu-counts.{filename}.csv", f"ins-shared-cacheline.{filename}.csv"))
+    stage.add_rows(process_numa_breakdown(cpu_lines_kernel, topology, f"ins-kernel-node-2mb-breakdown.{filename}.csv",
+                                          f"ins-kernel-cpu-counts.{filename}.csv", f"ins-shared-cacheline-kernel.{filename}.csv"))
+
+# Data heat, latency and SLC/remote miss attribution of the ldst samples
+def process_data_heat(data_heat):
+    """
+    Write where the accessed data lives, how slow the accesses are and which
+    code regions and PCs cause the SLC and remote misses. A workload with few
+    LLC-REFILL/REMOTE-ACCESS samples does not suffer from the CMN issue and
+    gains nothing from mitigation.
+
+    Args:
+        data_heat (DataHeat): Aggregated ldst samples from process_csv_pc.
+
+    Returns:
+        int: Number of ldst samples.
+    """
+    try:
+        result = data_heat.result()
+
+        with open(f"data-2mb-heat.{filename}.csv", "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["2mb_region", "samples", "llc_refill", "remote", "avg_latency", "page_touch_ratio"])
+            for region, samples, refill, remote, latency, ratio in result["regions"]:
+                writer.writerow([f"0x{region:x}", samples, refill, remote, f"{latency:.1f}", f"{ratio:.4f}"])
+
+        with open(f"data-page-heat.{filename}.csv", "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["page", "samples", "llc_refill", "remote", "avg_latency"])
+            for page, samples, refill, remote, latency in result["pages"]:
+                writer.writerow([f"0x{page:x}", samples, refill, remote, f"{latency:.1f}"])
+
+        with open(f"data-latency-histogram.{filename}.csv", "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["2mb_region"] + [latency_label(bucket) for bucket in range(LATENCY_BUCKETS)])
+            for region, counts in result["histogram"]:
+                writer.writerow([f"0x{region:x}"] + counts)
+
+        for name, key in (("code-regions", "code_regions"), ("miss-pcs", "miss_pcs")):
+            with open(f"data-{name}.{filename}.csv", "w", newline="") as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(["pc_2mb_region" if key == "code_regions" else "pc", "samples", "llc_refill", "remote", "avg_latency"])
+                for address, samples, refill, remote, latency in result[key]:
+                    writer.writerow([f"0x{address:x}", samples, refill, remote, f"{latency:.1f}"])
+
+        summary = result["summary"]
+        with open(f"data-summary.{filename}.txt", "w") as outfile:
+            for key, value in summary.items():
+                outfile.write(f"{key}: {value}\n")
+
+        logging.info(f"Data samples: {summary['llc_refill_ratio']:.2%} SLC refill, {summary['remote_ratio']:.2%} remote, "
+                     f"{summary['avg_latency']} cycles average in {summary['data_regions']} 2MB regions")
+        return summary["samples"]
+
+    except Exception as e:
+        logging.error(f"Error processing data heat: {e}")
+
+with profiler.stage("data-heat") as stage:
+    if data_heat is not None:
+        stage.add_rows(process_data_heat(data_heat))
+
+with profiler.stage("plot-heatmaps"):
+    plot_heatmap(pc_br_tgt_counts_user, f"br.{filename}.png")
+    plot_heatmap(pc_br_tgt_counts_kernel, f"br-kernel.{filename}.png")
+
+# Save a compact summary of the run, fleet.py indexes many of them
+def process_fleet_summary(output_file):
+    """
+    Args:
+        output_file (str): Output summary (spe-region-summary.<file>.json).
+
+    Returns:
+        int: Number of 2MB regions in the summary.
+    """
+    try:
+        spaces = {}
+        for space, counter, branch_counts in (("user", cpu_lines_user, pc_br_tgt_counts_user),
+                                              ("kernel", cpu_lines_kernel, pc_br_tgt_counts_kernel)):
+            _, lines, counts = counter.result()
+            spaces[space] = summarize_space(lines, counts, branch_counts)
+        write_summary(output_file, args.host, os.path.basename(filename), args.pid, capture_time(), spaces)
+        logging.info(f"Saved run summary of {args.host} -> {output_file}")
+        return sum(len(data["regions"]) for data in spaces.values())
+
+    except Exception as e:
+        logging.error(f"Error saving run summary {output_file}: {e}")
+
+with profiler.stage("fleet-summary") as stage:
+    stage.add_rows(process_fleet_summary(f"spe-region-summary.{filename}.json"))
+
+# Save the run report and the optional traces before moving outputs
+profiler.write_report(f"spe-region-report.{filename}.json")
+if args.trace:
+    profiler.write_trace(f"spe-region-trace.{filename}.json")
+if args.cprofile:
+    profiler.write_cprofile(f"spe-region.{filename}.prof")
+profiler.close()
 
 
 # Create the output folder if it doesn't exist
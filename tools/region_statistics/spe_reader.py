@@ -0,0 +1,309 @@
+import csv
+import logging
+
+import numpy as np
+
+# Constants
+HEX = 16
+DEC = 10
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_DIGITS = {HEX: 16, DEC: 19}
+
+NEWLINE = ord("\n")
+CARRIAGE_RETURN = ord("\r")
+COMMA = ord(",")
+QUOTE = ord('"')
+
+# Byte -> digit value, 255 for anything that is not a hex digit
+DIGIT_VALUES = np.full(256, 255, dtype=np.uint8)
+for i, c in enumerate(b"0123456789abcdef"):
+    DIGIT_VALUES[c] = i
+for i, c in enumerate(b"ABCDEF"):
+    DIGIT_VALUES[c] = 10 + i
+HEX_CHARS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+# Parse integer fields given by [start, end) byte offsets, without per-row Python objects
+def parse_int_fields(buf, start, end, base):
+    """
+    Args:
+        buf (np.ndarray): uint8 view of the block.
+        start, end (np.ndarray): Byte offsets of each field.
+        base (int): HEX (optional 0x prefix) or DEC.
+
+    Returns:
+        tuple: (values, bad) uint64 values and a mask of fields that are not valid numbers.
+    """
+    if base == HEX:
+        second = np.minimum(start + 1, len(buf) - 1)
+        has_prefix = (end - start >= 2) & (buf[start] == ord("0")) & ((buf[second] | 0x20) == ord("x"))
+        start = start + 2 * has_prefix
+
+    width = end - start
+    max_digits = MAX_DIGITS[base]
+    bad = width > max_digits
+    values = np.zeros(len(start), dtype=np.uint64)
+
+    for j in range(min(max_digits, int(width.max()) if len(width) else 0)):
+        active = j < width
+        digits = DIGIT_VALUES[buf[np.where(active, end - 1 - j, 0)]]
+        bad |= active & (digits >= base)
+        values += np.where(active & (digits < base), digits, 0).astype(np.uint64) * np.uint64(base ** j)
+
+    return values, bad
+
+
+# Flag fields containing a byte string
+def fields_contain(buf, start, end, needle):
+    """
+    Args:
+        buf (np.ndarray): uint8 view of the block.
+        start, end (np.ndarray): Byte offsets of each field, rows in file order.
+        needle (bytes): Byte string to look for.
+
+    Returns:
+        np.ndarray: Boolean mask of the fields containing needle.
+    """
+    size = len(needle)
+    candidates = np.flatnonzero(buf[:len(buf) - size + 1] == needle[0])
+    for t in range(1, size):
+        candidates = candidates[buf[candidates + t] == needle[t]]
+
+    found = np.zeros(len(start), dtype=bool)
+    row = np.searchsorted(start, candidates, side="right") - 1
+    valid = row >= 0
+    row, candidates = row[valid], candidates[valid]
+    found[row[candidates + size <= end[row]]] = True
+    return found
+
+
+# Format integers as hex text lines without per-row Python objects
+def format_hex_lines(values, prefix="0x"):
+    """
+    Args:
+        values (np.ndarray): Integers to format.
+        prefix (str): Prefix of every line.
+
+    Returns:
+        bytes: One "<prefix><hex>\\n" line per value, no leading zeros.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b""
+
+    shifts = np.arange(60, -1, -4, dtype=np.uint64)
+    nibbles = ((values[:, None] >> shifts) & np.uint64(0xf)).astype(np.uint8)
+    # Keep digits from the first non zero one, the last digit is always kept
+    keep = np.maximum.accumulate(nibbles != 0, axis=1)
+    keep[:, -1] = True
+
+    prefix = np.frombuffer(prefix.encode(), dtype=np.uint8)
+    width = len(prefix) + 16 + 1
+    chars = np.empty((len(values), width), dtype=np.uint8)
+    chars[:, :len(prefix)] = prefix
+    chars[:, len(prefix):-1] = HEX_CHARS[nibbles]
+    chars[:, -1] = NEWLINE
+
+    mask = np.ones((len(values), width), dtype=bool)
+    mask[:, len(prefix):-1] = keep
+    return chars[mask].tobytes()
+
+
+# Column names of a CSV file
+def read_header(path):
+    with open(path, "r", newline="") as infile:
+        return next(csv.reader(infile), [])
+
+# Requested value and flag columns that are not in a header
+def missing_columns(header, columns, flags=None):
+    needed = list(columns) + [column for column, _ in (flags or {}).values()]
+    return [name for name in needed if name not in header]
+
+
+class SpeCsvReader:
+    """
+    Chunked reader of spe-parser CSV files.
+
+    Reads large byte blocks, locates only the requested columns by header
+    index and parses them into integer arrays. Lines that do not split into
+    the header's column count, contain quotes or have invalid numbers go
+    through the csv module instead. Rows within a chunk are not kept in file
+    order: the fallback rows come after the vectorized ones.
+
+    Args:
+        path (str): Path to the CSV file.
+        columns (dict): Column name -> HEX or DEC.
+        flags (dict): Flag name -> (column name, substring), e.g.
+                      {"not_taken": ("event", "NOT-TAKEN")}.
+        chunk_size (int): Bytes read per block.
+
+    Iterating yields one dict per chunk with an array per column (uint64 for
+    HEX, int64 for DEC) and a boolean array per flag.
+    """
+
+    def __init__(self, path, columns, flags=None, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.columns = columns
+        self.flags = flags or {}
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.fallback_rows = 0
+        self.skipped_rows = 0
+        self.bytes_read = 0
+
+        self.header = read_header(path)
+        self.num_columns = len(self.header)
+        missing = missing_columns(self.header, columns, self.flags)
+        if missing:
+            raise ValueError(f"{path}: missing columns {', '.join(missing)}")
+        self.index = {name: self.header.index(name) for name in self.header}
+
+    def __iter__(self):
+        with open(self.path, "rb") as infile:
+            header_line = infile.readline()
+            self.bytes_read += len(header_line)
+            carry = b""
+            while True:
+                data = infile.read(self.chunk_size)
+                self.bytes_read += len(data)
+                if not data:
+                    if carry:
+                        yield self._parse_block(carry + b"\n")
+                    break
+                data = carry + data
+                last_newline = data.rfind(b"\n")
+                if last_newline < 0:
+                    carry = data
+                    continue
+                carry = data[last_newline + 1:]
+                yield self._parse_block(data[:last_newline + 1])
+
+        if self.skipped_rows:
+            logging.warning(f"Skipped {self.skipped_rows} malformed rows in {self.path}")
+
+    def _empty_chunk(self):
+        chunk = {name: np.empty(0, dtype=np.uint64 if base == HEX else np.int64) for name, base in self.columns.items()}
+        chunk.update({name: np.empty(0, dtype=bool) for name in self.flags})
+        return chunk
+
+    def _parse_block(self, block):
+        buf = np.frombuffer(block, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == NEWLINE)
+        line_start = np.concatenate([[0], newlines[:-1] + 1])
+        line_end = newlines - (buf[np.maximum(newlines - 1, 0)] == CARRIAGE_RETURN)
+        blank = line_end <= line_start
+
+        # Lines splitting into exactly the header's column count
+        commas = np.flatnonzero(buf == COMMA)
+        per_line = np.diff(np.searchsorted(commas, newlines), prepend=0)
+        quotes = np.flatnonzero(buf == QUOTE)
+        quoted = np.diff(np.searchsorted(quotes, newlines), prepend=0) > 0
+        good = (per_line == self.num_columns - 1) & ~quoted & ~blank
+        good_commas = commas[np.repeat(good, per_line)].reshape(-1, self.num_columns - 1)
+        good_start = line_start[good]
+        good_end = line_end[good]
+
+        def field_bounds(index):
+            start = good_start if index == 0 else good_commas[:, index - 1] + 1
+            end = good_end if index == self.num_columns - 1 else good_commas[:, index]
+            return start, end
+
+        chunk = {}
+        bad = np.zeros(len(good_start), dtype=bool)
+        for name, base in self.columns.items():
+            values, bad_values = parse_int_fields(buf, *field_bounds(self.index[name]), base)
+            chunk[name] = values if base == HEX else values.view(np.int64)
+            bad |= bad_values
+        for name, (column, needle) in self.flags.items():
+            chunk[name] = fields_contain(buf, *field_bounds(self.index[column]), needle.encode())
+
+        if bad.any():
+            chunk = {name: values[~bad] for name, values in chunk.items()}
+        self.rows += len(good_start) - int(bad.sum())
+
+        # Everything else goes through the csv module
+        fallback = np.flatnonzero(~good & ~blank)
+        fallback_lines = [block[line_start[i]:line_end[i]].decode(errors="replace") for i in fallback.tolist()]
+        bad_idx = np.flatnonzero(bad)
+        fallback_lines += [block[good_start[i]:good_end[i]].decode(errors="replace") for i in bad_idx.tolist()]
+        if fallback_lines:
+            chunk = self._merge(chunk, self._parse_fallback(fallback_lines))
+        return chunk
+
+    def _parse_fallback(self, lines):
+        values = {name: [] for name in list(self.columns) + list(self.flags)}
+        for row in csv.reader(lines):
+            try:
+                parsed = {name: int(row[self.index[name]] or "0", base) for name, base in self.columns.items()}
+                parsed.update({name: needle in row[self.index[column]] for name, (column, needle) in self.flags.items()})
+            except (IndexError, ValueError):
+                self.skipped_rows += 1
+                continue
+            for name, value in parsed.items():
+                values[name].append(value)
+
+        self.fallback_rows += len(values[next(iter(values))]) if values else 0
+        self.rows += len(values[next(iter(values))]) if values else 0
+        chunk = self._empty_chunk()
+        for name in values:
+            chunk[name] = np.array(values[name], dtype=chunk[name].dtype)
+        return chunk
+
+    @staticmethod
+    def _merge(chunk, extra):
+        return {name: np.concatenate([values, extra[name]]) for name, values in chunk.items()}
+
+
+# Read whole columns of a CSV file
+def read_spe_columns(path, columns, flags=None, chunk_size=CHUNK_SIZE):
+    """
+    Read the requested columns of a whole file, see SpeCsvReader.
+
+    Returns:
+        tuple: (data, reader) with one concatenated array per column/flag.
+    """
+    reader = SpeCsvReader(path, columns, flags, chunk_size)
+    chunks = list(reader)
+    if not chunks:
+        return reader._empty_chunk(), reader
+    return {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0]}, reader
+
+
+# Read a text file with one hex address per line in chunks
+def iter_hex_values(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield uint64 arrays of the addresses in a file such as ins.<file>.csv.
+    Lines that are not valid hex numbers are skipped.
+
+    Args:
+        path (str): Path to the address file, with or without 0x prefix.
+        chunk_size (int): Bytes read per block.
+    """
+    skipped = 0
+    with open(path, "rb") as infile:
+        carry = b""
+        while True:
+            data = infile.read(chunk_size)
+            if not data:
+                if not carry:
+                    break
+                data, carry = carry + b"\n", b""
+            else:
+                data = carry + data
+                last_newline = data.rfind(b"\n")
+                if last_newline < 0:
+                    carry = data
+                    continue
+                data, carry = data[:last_newline + 1], data[last_newline + 1:]
+
+            buf = np.frombuffer(data, dtype=np.uint8)
+            newlines = np.flatnonzero(buf == NEWLINE)
+            line_start = np.concatenate([[0], newlines[:-1] + 1])
+            line_end = newlines - (buf[np.maximum(newlines - 1, 0)] == CARRIAGE_RETURN)
+            values, bad = parse_int_fields(buf, line_start, line_end, HEX)
+            blank = line_end <= line_start
+            skipped += int((bad & ~blank).sum())
+            yield values[~(bad | blank)]
+
+    if skipped:
+        logging.warning(f"Skipped {skipped} malformed lines in {path}")
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import logging
+import resource
+import cProfile
+from contextlib import contextmanager
+
+# Read the I/O counters of this process, None when /proc is not available
+def read_proc_io():
+    try:
+        counters = {}
+        with open("/proc/self/io", "r") as infile:
+            for line in infile:
+                key, value = line.split(":")
+                counters[key] = int(value)
+        return counters.get("rchar", 0), counters.get("wchar", 0)
+    except (OSError, ValueError):
+        return None
+
+# CPU time of this process and its finished children (e.g. spe-parser)
+def cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+# Peak RSS in KB of this process over its lifetime and of its biggest finished child
+def peak_rss_kb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+# Reset the peak RSS of this process to its current RSS, False when the kernel does not support it
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as outfile:
+            outfile.write("5")
+        return True
+    except OSError:
+        return False
+
+# Peak RSS in KB of this process since the last reset_peak_rss(), None when /proc is not available
+def read_vmhwm_kb():
+    try:
+        with open("/proc/self/status", "r") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Stage:
+    """Measurements of one stage. Callers add processed rows with add_rows()."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.status = "ok"
+        self.errors = []
+        self.start = 0.0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.bytes_read = None
+        self.bytes_written = None
+        self.peak_rss_kb = 0
+        self.peak_rss_scope = "stage"
+
+    def add_rows(self, count):
+        if count:
+            self.rows += count
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "errors": self.errors,
+            "wall_s": round(self.wall_s, 6),
+            "cpu_s": round(self.cpu_s, 6),
+            "rows": self.rows,
+            "rows_per_s": round(self.rows / self.wall_s, 1) if self.wall_s > 0 else None,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_kb": self.peak_rss_kb,
+            "peak_rss_scope": self.peak_rss_scope,
+        }
+
+
+class StageErrorHandler(logging.Handler):
+    """Mark the current stage as failed when it logs an error."""
+
+    def __init__(self, profiler):
+        super().__init__(level=logging.ERROR)
+        self.profiler = profiler
+
+    def emit(self, record):
+        if self.profiler.current is not None:
+            self.profiler.current.status = "error"
+            self.profiler.current.errors.append(record.getMessage())
+
+
+class StageProfiler:
+    """
+    Collect per-stage wall/CPU time, rows, rows/sec, peak RSS and bytes
+    read/written. Stages are timed with `with profiler.stage(name) as stage:`.
+    The peak RSS is reset at the start of every stage (/proc/self/clear_refs),
+    where that is not possible it is the peak of the whole run so far and the
+    stage reports peak_rss_scope "process".
+    """
+
+    def __init__(self, enable_cprofile=False):
+        self.stages = []
+        self.current = None
+        self.start = time.perf_counter()
+        self.start_time = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.cprofile = cProfile.Profile() if enable_cprofile else None
+        self.peak_rss_kb = 0
+        self.handler = StageErrorHandler(self)
+        logging.getLogger().addHandler(self.handler)
+        if self.cprofile:
+            self.cprofile.enable()
+
+    @contextmanager
+    def stage(self, name):
+        stage = Stage(name)
+        io_start = read_proc_io()
+        cpu_start = cpu_time()
+        # Resetting the mark loses the run peak so far, keep it
+        self.peak_rss_kb = max(self.peak_rss_kb, peak_rss_kb())
+        children_rss_start = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        stage_rss = reset_peak_rss()
+        stage.start = time.perf_counter()
+        self.current = stage
+        try:
+            yield stage
+        except Exception as e:
+            stage.status = "error"
+            stage.errors.append(str(e))
+            raise
+        finally:
+            stage.wall_s = time.perf_counter() - stage.start
+            stage.cpu_s = cpu_time() - cpu_start
+            io_end = read_proc_io()
+            if io_start and io_end:
+                stage.bytes_read = io_end[0] - io_start[0]
+                stage.bytes_written = io_end[1] - io_start[1]
+            vmhwm = read_vmhwm_kb() if stage_rss else None
+            if vmhwm is not None:
+                # A child finished in this stage (e.g. spe-parser) counts if it set a new children peak
+                children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+                stage.peak_rss_kb = max(vmhwm, children_rss if children_rss > children_rss_start else 0)
+            else:
+                stage.peak_rss_kb = peak_rss_kb()
+                stage.peak_rss_scope = "process"
+            self.peak_rss_kb = max(self.peak_rss_kb, stage.peak_rss_kb)
+            self.current = None
+            self.stages.append(stage)
+            logging.info(f"Stage {name}: {stage.wall_s:.3f}s wall, {stage.cpu_s:.3f}s cpu, {stage.rows} rows, "
+                         f"{stage.peak_rss_kb} KB peak RSS" + (" (whole run)" if stage.peak_rss_scope == "process" else ""))
+
+    def report(self):
+        return {
+            "start_time": self.start_time,
+            "total_wall_s": round(time.perf_counter() - self.start, 6),
+            "total_cpu_s": round(cpu_time(), 6),
+            "peak_rss_kb": max(self.peak_rss_kb, peak_rss_kb()),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def write_report(self, output_file):
+        with open(output_file, "w") as outfile:
+            json.dump(self.report(), outfile, indent=2)
+        logging.info(f"Run report saved to {output_file}")
+
+    def write_trace(self, output_file):
+        """Write stages as Chrome trace events, viewable in Perfetto, chrome://tracing or speedscope."""
+        events = []
+        for stage in self.stages:
+            events.append({
+                "name": stage.name,
+                "ph": "X",
+                "ts": round((stage.start - self.start) * 1e6),
+                "dur": round(stage.wall_s * 1e6),
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": {k: v for k, v in stage.to_dict().items() if k not in ("name", "wall_s")},
+            })
+        with open(output_file, "w") as outfile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, outfile)
+        logging.info(f"Stage trace saved to {output_file}")
+
+    def write_cprofile(self, output_file):
+        """Write cProfile stats, readable with pstats, snakeviz or flameprof."""
+        if self.cprofile is None:
+            return
+        self.cprofile.disable()
+        self.cprofile.dump_stats(output_file)
+        logging.info(f"cProfile stats saved to {output_file}")
+
+    def close(self):
+        logging.getLogger().removeHandler(self.handler)
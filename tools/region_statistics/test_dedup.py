@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from dedup import ExternalUniq, sort_and_deduplicate_file
+
+
+class ExternalUniqTest(unittest.TestCase):
+    """The spilled result must match the in-memory one, including the values left in memory at the end."""
+
+    def dedup(self, chunks, memory_budget):
+        uniq = ExternalUniq(memory_budget)
+        for chunk in chunks:
+            uniq.add(chunk)
+        blocks = list(uniq.blocks())
+        return np.concatenate(blocks) if blocks else np.empty(0, dtype=np.uint64), uniq
+
+    def test_spilled_matches_in_memory(self):
+        rng = np.random.default_rng(1)
+        values = rng.choice(np.uint64(1) << np.uint64(40), size=1200000, replace=False).astype(np.uint64)
+        chunks = np.array_split(np.concatenate([values, values[:300000]]), 37)
+        expected = np.unique(values)
+        # Budgets that spill several runs and leave a small remainder in memory
+        for memory_budget in (5 << 20, 3 << 20, 1 << 20, 777777):
+            with self.subTest(memory_budget=memory_budget):
+                result, _ = self.dedup(chunks, memory_budget)
+                np.testing.assert_array_equal(result, expected)
+
+    def test_in_memory(self):
+        result, uniq = self.dedup([np.array([5, 3, 5], dtype=np.uint64), np.array([1, 3], dtype=np.uint64)], 1 << 20)
+        np.testing.assert_array_equal(result, [1, 3, 5])
+        self.assertEqual(uniq.runs, [])
+
+    def test_file_spilled_matches_in_memory(self):
+        rng = np.random.default_rng(2)
+        values = rng.integers(0, 1 << 48, size=300000, dtype=np.uint64)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "ins.csv")
+            with open(input_file, "w") as outfile:
+                outfile.writelines(f"0x{value:x}\n" for value in values.tolist())
+            outputs = []
+            for memory_budget in (1 << 30, 1 << 20):
+                output_file = os.path.join(tmpdir, f"uniq-{memory_budget}.csv")
+                count = sort_and_deduplicate_file(input_file, output_file, memory_budget)
+                self.assertEqual(count, len(np.unique(values)))
+                with open(output_file, "rb") as infile:
+                    outputs.append(infile.read())
+            self.assertEqual(outputs[0], outputs[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+import os
+import re
+import sys
+import csv
+import glob
+import argparse
+import logging
+
+import numpy as np
+
+from aggregate import GroupSums, regroup
+
+# Constants
+SYSFS_ROOT = "/sys/devices/system"
+REGION_SIZE = 2 * 1024 * 1024
+CACHELINE_SHIFT = 6
+CACHELINES_PER_REGION = REGION_SIZE >> CACHELINE_SHIFT
+
+
+# Parse a sysfs cpu list such as "0-3,8,10-11"
+def parse_cpu_list(text):
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+class CpuTopology:
+    """
+    CPU -> NUMA node and cluster maps as arrays indexed by CPU number,
+    -1 for CPUs that are not known.
+    """
+
+    def __init__(self, cpus, nodes, clusters):
+        size = max(cpus) + 1 if len(cpus) else 0
+        self.node = np.full(size, -1, dtype=np.int64)
+        self.cluster = np.full(size, -1, dtype=np.int64)
+        self.node[cpus] = nodes
+        self.cluster[cpus] = clusters
+
+    @classmethod
+    def from_sysfs(cls, root=SYSFS_ROOT):
+        node_of = {}
+        for node_dir in glob.glob(os.path.join(root, "node", "node[0-9]*")):
+            node = int(re.search(r"node(\d+)$", node_dir).group(1))
+            with open(os.path.join(node_dir, "cpulist"), "r") as infile:
+                for cpu in parse_cpu_list(infile.read()):
+                    node_of[cpu] = node
+
+        cpus, nodes, clusters = [], [], []
+        for cpu_dir in glob.glob(os.path.join(root, "cpu", "cpu[0-9]*")):
+            cpu = int(re.search(r"cpu(\d+)$", cpu_dir).group(1))
+            cluster = -1
+            for name in ("cluster_id", "physical_package_id"):
+                path = os.path.join(cpu_dir, "topology", name)
+                if os.path.exists(path):
+                    with open(path, "r") as infile:
+                        cluster = int(infile.read())
+                    break
+            cpus.append(cpu)
+            nodes.append(node_of.get(cpu, 0))
+            clusters.append(cluster)
+
+        if not cpus:
+            raise ValueError(f"No CPUs found under {root}")
+        return cls(cpus, nodes, clusters)
+
+    @classmethod
+    def from_file(cls, topology_file):
+        """Read a "cpu,node,cluster" CSV file with header, as written by save()."""
+        cpus, nodes, clusters = [], [], []
+        with open(topology_file, "r", newline="") as infile:
+            for row in csv.DictReader(infile):
+                cpus.append(int(row["cpu"]))
+                nodes.append(int(row["node"]))
+                clusters.append(int(row.get("cluster") or -1))
+        if not cpus:
+            raise ValueError(f"No CPUs in {topology_file}")
+        return cls(cpus, nodes, clusters)
+
+    def save(self, topology_file):
+        with open(topology_file, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["cpu", "node", "cluster"])
+            for cpu in np.flatnonzero(self.node >= 0).tolist():
+                writer.writerow([cpu, int(self.node[cpu]), int(self.cluster[cpu])])
+
+    def nodes_of(self, cpus):
+        cpus = np.asarray(cpus, dtype=np.int64)
+        known = (cpus >= 0) & (cpus < len(self.node))
+        return np.where(known, self.node[np.where(known, cpus, 0)], -1)
+
+
+class CpuLineCounter(GroupSums):
+    """Sample counts per (cpu, cacheline)."""
+
+    def __init__(self):
+        super().__init__(num_keys=2)
+
+    def add(self, cpus, addresses):
+        lines = np.asarray(addresses, dtype=np.uint64) >> np.uint64(CACHELINE_SHIFT)
+        super().add([cpus, lines])
+
+    def result(self):
+        """
+        Returns:
+            tuple: (cpus, lines, counts) arrays, lines are address >> 6.
+        """
+        keys, sums = super().result()
+        return keys[:, 0], keys[:, 1], sums[:, 0]
+
+
+# Per-CPU, per-node/2MB region breakdown and cachelines shared between nodes
+def node_breakdown(counter, topology):
+    """
+    Args:
+        counter (CpuLineCounter): Sample counts per (cpu, cacheline).
+        topology (CpuTopology): CPU to node map.
+
+    Returns:
+        dict: "cpus" rows (cpu, node, cluster, samples), "regions" rows
+              (node, region, samples, cacheline_touch_ratio), "shared" rows
+              (cacheline address, nodes, samples) of lines touched from more
+              than one known node.
+    """
+    cpus, lines, counts = counter.result()
+    counts = counts.reshape(-1, 1)
+
+    # Per CPU
+    cpu_ids, cpu_samples, _ = regroup(cpus, counts)
+    cpu_nodes = topology.nodes_of(cpu_ids)
+    known = (cpu_ids >= 0) & (cpu_ids < len(topology.cluster))
+    cpu_clusters = np.where(known, topology.cluster[np.where(known, cpu_ids, 0)], -1)
+    cpu_rows = list(zip(cpu_ids.tolist(), cpu_nodes.tolist(), cpu_clusters.tolist(), cpu_samples[:, 0].tolist()))
+
+    # Per node and 2MB region: samples and touched cachelines
+    node_lines, node_line_samples, _ = regroup(np.stack([topology.nodes_of(cpus), lines], axis=1), counts)
+    regions = node_lines[:, 1] // CACHELINES_PER_REGION
+    node_regions, region_samples, region_lines = regroup(np.stack([node_lines[:, 0], regions], axis=1), node_line_samples)
+    region_rows = [(node, region * REGION_SIZE, samples, touched / CACHELINES_PER_REGION)
+                   for (node, region), samples, touched in zip(node_regions.tolist(), region_samples[:, 0].tolist(), region_lines.tolist())]
+
+    # Lines touched from more than one node, CPUs missing from the topology (node -1) are not a node
+    known_lines = node_lines[:, 0] >= 0
+    line_ids, line_samples, line_nodes = regroup(node_lines[known_lines, 1], node_line_samples[known_lines])
+    shared = line_nodes > 1
+    shared_rows = list(zip((line_ids[shared].astype(np.uint64) << np.uint64(CACHELINE_SHIFT)).tolist(),
+                           line_nodes[shared].tolist(), line_samples[shared, 0].tolist()))
+
+    return {"cpus": cpu_rows, "regions": region_rows, "shared": shared_rows}
+
+
+# Main execution
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Save the CPU -> NUMA node/cluster topology of this host for offline analysis.")
+    parser.add_argument("topology_file", help="Output topology file (cpu,node,cluster CSV)")
+    parser.add_argument("--sysfs", default=SYSFS_ROOT, help=f"sysfs system folder (default: {SYSFS_ROOT})")
+    args = parser.parse_args()
+
+    try:
+        topology = CpuTopology.from_sysfs(args.sysfs)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error reading CPU topology: {e}")
+        sys.exit(1)
+    topology.save(args.topology_file)
+    logging.info(f"Saved topology of {np.count_nonzero(topology.node >= 0)} CPUs to {args.topology_file}")
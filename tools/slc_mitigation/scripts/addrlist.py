@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import zlib
+import struct
+import argparse
+import logging
+
+import numpy as np
+
+# Binary address list, little endian:
+#   header  magic, version, flags, granularity, pid, crc32 of the payload,
+#           capture timestamp (ns since epoch), address count, address bytes
+#   payload sorted unique addresses as varint (LEB128) deltas from the previous
+#           one, then uint32 hotness weights if FLAG_WEIGHTS is set
+MAGIC = b"SLCADDR\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIIQQQ")
+FLAG_WEIGHTS = 1
+FLAG_KERNEL = 2
+MAX_VARINT_BYTES = 10
+
+
+class AddressListError(ValueError):
+    """The file is not a valid address list, or does not match the target."""
+
+
+class AddressList:
+    """
+    Sorted unique addresses with optional weights and the capture metadata.
+
+    Args:
+        addresses (np.ndarray): uint64 addresses, sorted and unique (see from_addresses).
+        weights (np.ndarray): uint32 hotness per address (e.g. samples), None if not known.
+        pid (int): Profiled process, 0 if not bound to a process.
+        granularity (int): Address granularity in bytes (1 for PCs, 64 for cachelines).
+        timestamp (float): Capture time in seconds since epoch, defaults to now.
+        kernel (bool): Kernel addresses, only valid for the boot they were captured in.
+    """
+
+    def __init__(self, addresses, weights=None, pid=0, granularity=1, timestamp=None, kernel=False):
+        self.addresses = addresses
+        self.weights = weights
+        self.pid = pid
+        self.granularity = granularity
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.kernel = kernel
+
+    @classmethod
+    def from_addresses(cls, addresses, weights=None, **kwargs):
+        """Sort and deduplicate addresses, weights of duplicated addresses are added up."""
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        unique, inverse = np.unique(addresses, return_inverse=True)
+        if weights is not None:
+            weights = np.bincount(inverse.reshape(-1), weights=weights, minlength=len(unique)).astype(np.uint32)
+        return cls(unique, weights, **kwargs)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def hottest(self, count):
+        """Return the `count` hottest addresses (the first ones if there are no weights), sorted."""
+        if len(self.addresses) <= count:
+            return self.addresses
+        if self.weights is None:
+            return self.addresses[:count]
+        return np.sort(self.addresses[np.argpartition(-self.weights.astype(np.int64), count)[:count]])
+
+
+# Encode uint64 values as LEB128 varints, vectorized
+def encode_varints(values):
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for i in range(1, MAX_VARINT_BYTES):
+        sizes += (values >> np.uint64(7 * i)) != 0
+
+    owner = np.repeat(np.arange(len(values)), sizes)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    data = (values[owner] >> (np.uint64(7) * position.astype(np.uint64))) & np.uint64(0x7f)
+    more = position < sizes[owner] - 1
+    return (data | (more.astype(np.uint64) << np.uint64(7))).astype(np.uint8).tobytes()
+
+
+# Decode `count` LEB128 varints, vectorized
+def decode_varints(data, count):
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) != count or (count and ends[-1] != len(data) - 1):
+        raise AddressListError(f"Corrupt address data: {len(ends)} values, {count} expected")
+    if count == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    sizes = ends - starts + 1
+    if sizes.max() > MAX_VARINT_BYTES:
+        raise AddressListError("Corrupt address data: varint too long")
+    position = np.arange(len(data)) - np.repeat(starts, sizes)
+    parts = (data & 0x7f).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+    return np.add.reduceat(parts, starts)
+
+
+# Save an address list
+def write_address_list(path, address_list):
+    """
+    Args:
+        path (str): Output file (.addr).
+        address_list (AddressList): Addresses and metadata.
+
+    Returns:
+        int: Bytes written.
+    """
+    deltas = np.diff(address_list.addresses, prepend=np.uint64(0))
+    payload = encode_varints(deltas)
+    address_bytes = len(payload)
+    flags = FLAG_KERNEL if address_list.kernel else 0
+    if address_list.weights is not None:
+        flags |= FLAG_WEIGHTS
+        payload += address_list.weights.astype("<u4").tobytes()
+
+    header = HEADER.pack(MAGIC, VERSION, flags, address_list.granularity, address_list.pid, zlib.crc32(payload),
+                         int(address_list.timestamp * 1e9), len(address_list.addresses), address_bytes)
+    with open(path, "wb") as outfile:
+        outfile.write(header)
+        outfile.write(payload)
+    return len(header) + len(payload)
+
+
+# Load an address list, rejecting stale or mismatched ones
+def read_address_list(path, pid=None, granularity=None, kernel=None, check_age=True):
+    """
+    Args:
+        path (str): Address list file.
+        pid (int): Expected process, rejects lists bound to another one.
+        granularity (int): Expected granularity in bytes.
+        kernel (bool): Expect a kernel (True) or a user space (False) list.
+        check_age (bool): Reject user lists captured before the process started,
+                          and kernel lists captured before the last boot.
+
+    Returns:
+        AddressList: The addresses and metadata.
+
+    Raises:
+        AddressListError: The file is corrupt, stale or does not match.
+    """
+    with open(path, "rb") as infile:
+        data = infile.read()
+    if len(data) < HEADER.size:
+        raise AddressListError(f"{path}: too short for an address list")
+    magic, version, flags, file_granularity, file_pid, crc, timestamp_ns, count, address_bytes = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise AddressListError(f"{path}: not an address list")
+    if version != VERSION:
+        raise AddressListError(f"{path}: unsupported version {version}")
+
+    payload = memoryview(data)[HEADER.size:]
+    weight_bytes = 4 * count if flags & FLAG_WEIGHTS else 0
+    if len(payload) != address_bytes + weight_bytes or zlib.crc32(payload) != crc:
+        raise AddressListError(f"{path}: corrupt payload")
+
+    timestamp = timestamp_ns / 1e9
+    file_kernel = bool(flags & FLAG_KERNEL)
+    if kernel is not None and kernel != file_kernel:
+        raise AddressListError(f"{path}: {'kernel' if file_kernel else 'user space'} list")
+    if pid is not None and file_pid and file_pid != pid:
+        raise AddressListError(f"{path}: captured for pid {file_pid}, not {pid}")
+    if granularity is not None and file_granularity != granularity:
+        raise AddressListError(f"{path}: granularity {file_granularity}, expected {granularity}")
+    if check_age:
+        if file_kernel:
+            started, what = boot_time(), "the last boot"
+        else:
+            started, what = process_start_time(pid or file_pid), f"pid {pid or file_pid} started"
+        if started is not None and timestamp < started:
+            raise AddressListError(f"{path}: stale, captured {time.ctime(timestamp)} before {what} {time.ctime(started)}")
+
+    addresses = np.cumsum(decode_varints(payload[:address_bytes], count), dtype=np.uint64)
+    weights = np.frombuffer(payload, dtype="<u4", offset=address_bytes) if weight_bytes else None
+    return AddressList(addresses, weights, pid=file_pid, granularity=file_granularity, timestamp=timestamp, kernel=file_kernel)
+
+
+# Read a text file with one hex address per line (the legacy handoff format)
+def read_hex_file(path):
+    with open(path, "rb") as infile:
+        lines = infile.read().split()
+    return np.array([int(line, 16) for line in lines], dtype=np.uint64)
+
+
+# Load up to `count` addresses for mitigation, from the binary list or the legacy text file, whichever is newer
+def load_addresses(addr_file, text_file, count, pid=None, kernel=False):
+    """
+    Returns:
+        np.ndarray: Sorted uint64 addresses, the hottest ones if the list has weights.
+
+    Raises:
+        AddressListError: The binary list is corrupt, stale or does not match.
+    """
+    if os.path.exists(addr_file) and (not os.path.exists(text_file) or os.path.getmtime(addr_file) >= os.path.getmtime(text_file)):
+        return read_address_list(addr_file, pid=pid, kernel=kernel).hottest(count)
+    return np.sort(read_hex_file(text_file))[:count]
+
+
+# Boot time in seconds since epoch
+def boot_time():
+    try:
+        with open("/proc/stat", "r") as infile:
+            for line in infile:
+                if line.startswith("btime "):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# Start time of a process in seconds since epoch, None if unknown
+def process_start_time(pid):
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat", "r") as infile:
+            # Fields after the command name, which may contain spaces
+            fields = infile.read().rsplit(")", 1)[1].split()
+        btime = boot_time()
+        if btime is None:
+            return None
+        return btime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# Main execution
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Convert and inspect binary address lists.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    encode = subparsers.add_parser("encode", help="Encode a hex text file (one address per line)")
+    encode.add_argument("input_file", help="Hex text file")
+    encode.add_argument("output_file", help="Output address list (.addr)")
+    encode.add_argument("-p", "--pid", type=int, default=0, help="Profiled pid (default: 0, not bound)")
+    encode.add_argument("-g", "--granularity", type=int, default=64, help="Address granularity in bytes (default: 64)")
+    encode.add_argument("-k", "--kernel", action="store_true", help="Kernel addresses")
+    encode.add_argument("-t", "--timestamp", type=float, help="Capture time in seconds since epoch (default: input file mtime)")
+    decode = subparsers.add_parser("decode", help="Print the addresses as hex text")
+    decode.add_argument("input_file", help="Address list")
+    info = subparsers.add_parser("info", help="Print the header and an address summary")
+    info.add_argument("input_file", help="Address list")
+    diff = subparsers.add_parser("diff", help="Compare two address lists (e.g. mitigate-top.py snapshots)")
+    diff.add_argument("input_file", help="Old address list")
+    diff.add_argument("new_file", help="New address list")
+    diff.add_argument("-v", "--verbose", action="store_true", help="Also print the removed (-) and added (+) addresses")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "encode":
+            timestamp = args.timestamp if args.timestamp is not None else os.path.getmtime(args.input_file)
+            address_list = AddressList.from_addresses(read_hex_file(args.input_file), pid=args.pid, granularity=args.granularity,
+                                       timestamp=timestamp, kernel=args.kernel)
+            size = write_address_list(args.output_file, address_list)
+            logging.info(f"Encoded {len(address_list)} addresses in {size} bytes to {args.output_file}")
+        else:
+            address_list = read_address_list(args.input_file, check_age=False)
+            if args.command == "diff":
+                new_list = read_address_list(args.new_file, check_age=False)
+                removed = np.setdiff1d(address_list.addresses, new_list.addresses, assume_unique=True)
+                added = np.setdiff1d(new_list.addresses, address_list.addresses, assume_unique=True)
+                print(f"old: {len(address_list)}, new: {len(new_list)}, common: {len(new_list) - len(added)}, "
+                      f"removed: {len(removed)}, added: {len(added)}")
+                if args.verbose:
+                    sys.stdout.write("".join(f"-{address:x}\n" for address in removed.tolist()))
+                    sys.stdout.write("".join(f"+{address:x}\n" for address in added.tolist()))
+            elif args.command == "decode":
+                sys.stdout.write("".join(f"{address:x}\n" for address in address_list.addresses.tolist()))
+            else:
+                print(f"pid: {address_list.pid}")
+                print(f"kernel: {address_list.kernel}")
+                print(f"granularity: {address_list.granularity}")
+                print(f"captured: {time.ctime(address_list.timestamp)}")
+                print(f"addresses: {len(address_list)}")
+                print(f"weights: {address_list.weights is not None}")
+                if len(address_list):
+                    print(f"range: 0x{int(address_list.addresses[0]):x} - 0x{int(address_list.addresses[-1]):x}")
+    except (OSError, ValueError) as e:
+        logging.error(f"Error processing {args.input_file}: {e}")
+        sys.exit(1)
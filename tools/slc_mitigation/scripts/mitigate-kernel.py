@@ -6,6 +6,8 @@ import argparse
 import sys
 import os
 
+from addrlist import load_addresses, AddressListError
+
 # Define the structure
 class AddressBuffers:
     def __init__(self, buffer_size):
@@ -24,6 +26,8 @@ MAP_FILE_NAME = "/dev/mitigation"
 # Create an instance of AddressBuffers
 address_buffers = AddressBuffers(BUFFER_SIZE)
 total_mem_size = 24 + 2*BUFFER_SIZE
+# Addresses that fit in the mapped area after the header
+max_addresses = (total_mem_size - 24) // 8
 
 
 parser = argparse.ArgumentParser(description="Process some integers.")
@@ -81,14 +85,14 @@ with open('/dev/mitigation', 'r+b', buffering=0) as f:
     
     
     if args.dump:
-        # Read the content of ins-uniq.csv and fill buffer1
-        with open('ins-uniq-kernel.csv', 'r') as ff:
-            lines = ff.readlines()
-            for i, line in enumerate(lines):
-                if i < BUFFER_SIZE:
-                    address_buffers.buffer1[i] = int(line.strip(), 16)
-                    address_buffers.valid_size1 += 1
-        
+        # Read ins-uniq-kernel.addr (or ins-uniq-kernel.csv) into buffer1, keeping the hottest addresses that fit the mapping
+        try:
+            addresses = load_addresses('ins-uniq-kernel.addr', 'ins-uniq-kernel.csv', max_addresses, kernel=True)
+        except (OSError, AddressListError) as e:
+            print("Error: {0}".format(e))
+            sys.exit(1)
+        address_buffers.valid_size1 = len(addresses)
+
         # Create a binary file and write the structure to it
         # Write valid_size1, valid_size2, active_buffer
         mm.seek(struct.calcsize('II'))
@@ -96,14 +100,9 @@ with open('/dev/mitigation', 'r+b', buffering=0) as f:
         mm.write(struct.pack('I', address_buffers.valid_size2))
         mm.write(struct.pack('I', address_buffers.active_buffer))
         mm.write(struct.pack('I', address_buffers.pad))
-        
-        # Write buffer1 and buffer2
-        for i in range(address_buffers.valid_size1):
-            value = address_buffers.buffer1[i]
-            mm.write(struct.pack('Q', value))
-        for i in range(address_buffers.valid_size2):
-            value = address_buffers.buffer2[i]
-            mm.write(struct.pack('Q', value))
+
+        # Write buffer1
+        mm.write(addresses.astype('<u8').tobytes())
     
         print("Memory map communication file created successfully.")
 
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+
+import os
+import re
+import sys
+import glob
+import time
+import mmap
+import struct
+import argparse
+import logging
+
+import numpy as np
+
+from addrlist import AddressList, write_address_list
+
+# Constants, the layout of AddressBuffers in user/mitigation.c and kernel/mitigation-module.c
+BUFFER_SIZE = 1048576
+HEADER = struct.Struct("<6I")
+USER_FILES = "/tmp/addr_buffer.*"
+DEVICE_FILE = "/dev/mitigation"
+DEVICE_MAP_SIZE = 24 + 2 * BUFFER_SIZE  # what mitigate-kernel.py maps
+DEFAULT_CLEAN_INTERVAL = 1000
+RESCAN_INTERVAL = 1.0
+REGION_SHIFT = 21
+
+
+class BufferView:
+    """
+    Read-only mapping of one address buffer, kept open between refreshes.
+    The header is unpacked in place and the addresses are numpy views on the
+    mapping, the summary is only recomputed when the sizes, the active buffer
+    or its first/last address change.
+    """
+
+    def __init__(self, path, pid, map_size=None):
+        self.path = path
+        self.pid = pid
+        self.map_size = map_size
+        self.fd = os.open(path, os.O_RDONLY)
+        self.mm = None
+        self.size = 0
+        self.summary_key = None
+        self.summary = None
+        self.changed = time.time()
+        self.remap()
+
+    def remap(self):
+        """Map the buffer again if the file grew (mitigation.so truncates it to full size)."""
+        size = self.map_size or os.fstat(self.fd).st_size
+        if size == self.size:
+            return
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ) if size >= HEADER.size else None
+        self.size = size if self.mm is not None else 0
+
+    def header(self):
+        """
+        Returns:
+            tuple: (mitigation_start, clean_interval, valid_size1, valid_size2, active_buffer, pad), None if empty.
+        """
+        return HEADER.unpack_from(self.mm, 0) if self.mm is not None else None
+
+    def addresses(self, header, index=None):
+        """View of the valid addresses of a buffer, the active one by default."""
+        index = min(header[4], 1) if index is None else index
+        offset = HEADER.size + index * BUFFER_SIZE * 8
+        count = min(header[2 + index], BUFFER_SIZE, max(self.size - offset, 0) // 8)
+        return np.frombuffer(self.mm, dtype="<u8", count=count, offset=offset) if count else np.empty(0, dtype=np.uint64)
+
+    def address_summary(self, header):
+        """
+        Returns:
+            tuple: (count, lowest, highest, 2MB regions) of the active buffer.
+        """
+        addresses = self.addresses(header)
+        # A new dump of the same size still changes the first or last address
+        key = header[2:5] + ((int(addresses[0]), int(addresses[-1])) if len(addresses) else ())
+        if key != self.summary_key:
+            if len(addresses):
+                self.summary = (len(addresses), int(addresses.min()), int(addresses.max()),
+                                len(np.unique(addresses >> np.uint64(REGION_SHIFT))))
+            else:
+                self.summary = (0, 0, 0, 0)
+            if self.summary_key is not None:
+                self.changed = time.time()
+            self.summary_key = key
+        del addresses
+        return self.summary
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        os.close(self.fd)
+
+
+# Command name of a process, empty if it is gone
+def process_name(pid):
+    try:
+        with open(f"/proc/{pid}/comm", "r") as infile:
+            return infile.read().strip()
+    except OSError:
+        return ""
+
+
+# Open new buffers and drop the removed ones
+def rescan(views, pids, kernel):
+    paths = {}
+    for path in glob.glob(USER_FILES):
+        match = re.search(r"\.(\d+)$", path)
+        if match and (not pids or int(match.group(1)) in pids):
+            paths[path] = int(match.group(1))
+    if kernel and os.path.exists(DEVICE_FILE):
+        paths[DEVICE_FILE] = 0
+
+    for path in list(views):
+        if path not in paths:
+            views.pop(path).close()
+    for path, pid in paths.items():
+        if path in views:
+            views[path].remap()
+            continue
+        try:
+            views[path] = BufferView(path, pid, DEVICE_MAP_SIZE if path == DEVICE_FILE else None)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Cannot map {path}: {e}")
+    return {path: process_name(pid) if pid else "kernel" for path, pid in paths.items() if path in views}
+
+
+# One screen of buffer states
+def render(views, names):
+    now = time.time()
+    lines = [f"mitigate-top - {time.strftime('%H:%M:%S')} - {len(views)} buffers",
+             "",
+             f"{'PID':>8} {'COMMAND':<16} {'STATE':<5} {'INTERVAL':>9} {'VALID1':>8} {'VALID2':>8} {'ACT':>3} "
+             f"{'ADDRS':>8} {'2MB':>5} {'LOWEST':>18} {'HIGHEST':>18} {'CHANGED':>8}"]
+    for path, view in sorted(views.items(), key=lambda item: item[1].pid):
+        header = view.header()
+        if header is None:
+            lines.append(f"{view.pid or '-':>8} {names.get(path, '')[:16]:<16} {'empty':<5}")
+            continue
+        start, interval, valid1, valid2, active, _ = header
+        count, lowest, highest, regions = view.address_summary(header)
+        name = names.get(path) or "(gone)"
+        lines.append(f"{view.pid or '-':>8} {name[:16]:<16} {'on' if start else 'off':<5} "
+                     f"{(interval or DEFAULT_CLEAN_INTERVAL):>7}us {valid1:>8} {valid2:>8} {active:>3} "
+                     f"{count:>8} {regions:>5} {lowest:>#18x} {highest:>#18x} {now - view.changed:>7.0f}s")
+    return "\n".join(lines) + "\n"
+
+
+# Save the active buffer of every view as a binary address list
+def snapshot(views, output_dir, granularity):
+    """
+    Args:
+        views (dict): BufferView per path.
+        output_dir (str): Output folder, files are snapshot.<pid|kernel>.<time>.addr
+        granularity (int): Granularity recorded in the lists.
+
+    Returns:
+        list: Written files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    files = []
+    for view in views.values():
+        header = view.header()
+        if header is None:
+            continue
+        address_list = AddressList.from_addresses(view.addresses(header).copy(), pid=view.pid,
+                                                  granularity=granularity, kernel=view.pid == 0)
+        output_file = os.path.join(output_dir, f"snapshot.{view.pid or 'kernel'}.{stamp}.addr")
+        write_address_list(output_file, address_list)
+        logging.info(f"Saved {len(address_list)} addresses of {view.path} to {output_file}")
+        files.append(output_file)
+    return files
+
+
+# Main execution
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Show the state of the mitigation address buffers (/tmp/addr_buffer.<pid>, /dev/mitigation).")
+    parser.add_argument("-i", "--interval", type=float, default=0.1, help="Refresh interval in seconds (default: 0.1)")
+    parser.add_argument("-n", "--iterations", type=int, help="Exit after N refreshes")
+    parser.add_argument("-p", "--pids", nargs="+", type=int, help="Only show these PIDs")
+    parser.add_argument("--no-kernel", action="store_true", help=f"Do not map {DEVICE_FILE}")
+    parser.add_argument("-s", "--snapshot", metavar="DIR", help="Save the active buffers as address lists (.addr) to DIR and exit")
+    parser.add_argument("-g", "--granularity", type=int, default=64, help="Granularity recorded in snapshots (default: 64)")
+    args = parser.parse_args()
+
+    views = {}
+    names = rescan(views, args.pids, not args.no_kernel)
+    if not views:
+        logging.error(f"No buffers found ({USER_FILES}, {DEVICE_FILE})")
+        sys.exit(1)
+
+    try:
+        if args.snapshot:
+            snapshot(views, args.snapshot, args.granularity)
+            sys.exit(0)
+
+        clear = "\033[H\033[J" if sys.stdout.isatty() else ""
+        last_scan = time.monotonic()
+        iteration = 0
+        while args.iterations is None or iteration < args.iterations:
+            if time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                names = rescan(views, args.pids, not args.no_kernel)
+                last_scan = time.monotonic()
+            sys.stdout.write(clear + render(views, names))
+            sys.stdout.flush()
+            iteration += 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for view in views.values():
+            view.close()
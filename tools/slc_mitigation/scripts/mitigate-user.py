@@ -6,6 +6,8 @@ import argparse
 import sys
 import os
 
+from addrlist import load_addresses, AddressListError
+
 # Define the structure
 class AddressBuffers:
     def __init__(self, buffer_size):
@@ -83,17 +85,18 @@ if args.pids:
                 f.write(struct.pack('I', address_buffers.clean_interval))
             print("Interval updated to {0}".format(address_buffers.clean_interval))
         
+        addr_file='ins-uniq.'+str(pid)+'.addr'
         csv_file='ins-uniq.'+str(pid)+'.csv'
-        
+
         if args.dump:
-            # Read the content of ins-uniq.csv and fill buffer1
-            with open(csv_file, 'r') as f:
-                lines = f.readlines()
-                for i, line in enumerate(lines):
-                    if i < BUFFER_SIZE:
-                        address_buffers.buffer1[i] = int(line.strip(), 16)
-                        address_buffers.valid_size1 += 1
-            
+            # Read ins-uniq.<pid>.addr (or ins-uniq.<pid>.csv) into buffer1, keeping the hottest addresses if too many
+            try:
+                addresses = load_addresses(addr_file, csv_file, BUFFER_SIZE, pid=pid, kernel=False)
+            except (OSError, AddressListError) as e:
+                print("Error: {0}".format(e))
+                continue
+            address_buffers.valid_size1 = len(addresses)
+
             # Create a binary file and write the structure to it
             with open(MAP_FILE_NAME, 'r+b') as f:
                 # Write valid_size1, valid_size2, active_buffer
@@ -102,14 +105,9 @@ if args.pids:
                 f.write(struct.pack('I', address_buffers.valid_size2))
                 f.write(struct.pack('I', address_buffers.active_buffer))
                 f.write(struct.pack('I', address_buffers.pad))
-                
-                # Write buffer1 and buffer2
-                for i in range(address_buffers.valid_size1):
-                    value = address_buffers.buffer1[i]
-                    f.write(struct.pack('Q', value))
-                for i in range(address_buffers.valid_size2):
-                    value = address_buffers.buffer2[i]
-                    f.write(struct.pack('Q', value))
-        
+
+                # Write buffer1
+                f.write(addresses.astype('<u8').tobytes())
+
                 print("Memory map communication file created successfully.")
 
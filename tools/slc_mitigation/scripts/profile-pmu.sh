@@ -30,6 +30,8 @@ for pid in "$@"; do
 	rm -f ins-kernel-cacheline.$pid.csv
 	rm -f ins-uniq.$pid.csv
 	rm -f ins-uniq-kernel.csv
+	rm -f ins-uniq.$pid.addr
+	rm -f ins-uniq-kernel.addr
 
 	echo "profiling $pid"
 	perf record -F 20000 -p $pid -- sleep 3
@@ -50,6 +52,10 @@ for pid in "$@"; do
         sort ins-cacheline.$pid.csv | uniq  > ins-uniq.$pid.csv
         sort ins-kernel-cacheline.$pid.csv | uniq  > ins-uniq-kernel.csv
 
+        # Binary address lists, bound to the pid and the boot they were captured in
+        ./addrlist.py encode ins-uniq.$pid.csv ins-uniq.$pid.addr -p $pid
+        ./addrlist.py encode ins-uniq-kernel.csv ins-uniq-kernel.addr -k
+
 	./mitigate-user.py -d -p $pid
 
     else
@@ -32,6 +32,8 @@ for pid in "$@"; do
         rm -f ins-kernel-cacheline.$pid.csv
         rm -f ins-uniq.$pid.csv
         rm -f ins-uniq-kernel.csv
+        rm -f ins-uniq.$pid.addr
+        rm -f ins-uniq-kernel.addr
 
         echo "profiling $pid"
         #perf record --no-switch-events  -e 'arm_spe_0/jitter=1/' -c 10240 -N  -p $pid -- sleep 1
@@ -58,6 +60,10 @@ for pid in "$@"; do
         sort ins-cacheline.$pid.csv | uniq  > ins-uniq.$pid.csv
         sort ins-kernel-cacheline.$pid.csv | uniq  > ins-uniq-kernel.csv
 
+        # Binary address lists, bound to the pid and the boot they were captured in
+        ./addrlist.py encode ins-uniq.$pid.csv ins-uniq.$pid.addr -p $pid
+        ./addrlist.py encode ins-uniq-kernel.csv ins-uniq-kernel.addr -k
+
         ./mitigate-user.py -d -p $pid
 
     else